@@ -1,80 +1,180 @@
 import json
-import select
 import socket
+import uuid
 
+from src.adapters.recording import RecordKind, RecordingSocket, SessionRecorder
+from src.adapters.status import SharedMemoryStatusObserver
 from src.domain.engine import SessionFactory, Session
 from src.domain.exceptions import SessionFactoryError, SessionIsClosed, CommandIsNotAvailable, InvalidCommand
-from src.domain.player import Player
+from src.domain.player import Player, PlayerRegistry
+from src.domain.timeline import TimelineTransform
+from src.generic.clock import Clock
 from .player import TextPlaybackBuilder
 from ...entrypoints.socket.monitor import MOCK_MONITOR_SOCKET_HOST, MOCK_MONITOR_SOCKET_PORT
 
+PLAYER_IDLE_TIMEOUT = 300
+
 
 class SocketSession(Session):
-    def __init__(self, client_socket: socket.socket, player: Player):
+    def __init__(self, client_socket: socket.socket, player_registry: PlayerRegistry):
         self.client_socket = client_socket
-        self.player = player
+        self.player_registry = player_registry
+        self.token = uuid.uuid4().hex.encode()
+        self.is_anonymous = True
+        self.player = self.player_registry.attach(token=self.token)
 
     def next(self):
-        to_read, _, _ = select.select([self.client_socket], [], [], 0)
-        if self.client_socket in to_read:
-            body = self.client_socket.recv(4096).split(b':', maxsplit=1)
-            try:
-                if len(body) == 1:
-                    [command_type] = body
-                    if command_type == b'':
-                        self.client_socket.close()
-                        raise SessionIsClosed()
-                    if command_type == b'clear':
-                        self.player.clear_playback()
-                    elif command_type == b'play':
-                        self.player.play()
-                    elif command_type == b'pause':
-                        self.player.pause()
-                    elif command_type == b'stop':
-                        self.player.stop()
-                    else:
-                        raise InvalidCommand()
-                elif len(body) == 2:
-                    command_type, payload = body
-                    if command_type == b'load':
-                        self.player.load_playback(source=payload)
-                    elif command_type == b'cursor':
-                        payload = int(payload)
-                        self.player.set_cursor(timestamp=payload)
-                    else:
-                        raise InvalidCommand()
+        body = self.client_socket.recv(4096).split(b':', maxsplit=1)
+        try:
+            if len(body) == 1:
+                [command_type] = body
+                if command_type == b'':
+                    self.close()
+                    raise SessionIsClosed()
+                if command_type == b'clear':
+                    self.player.clear_playback()
+                elif command_type == b'play':
+                    self.player.play()
+                elif command_type == b'pause':
+                    self.player.pause()
+                elif command_type == b'stop':
+                    self.player.stop()
+                else:
+                    raise InvalidCommand()
+            elif len(body) == 2:
+                command_type, payload = body
+                if command_type == b'session':
+                    self.attach(token=payload)
+                elif command_type == b'load':
+                    self.player.load_playback(source=payload)
+                elif command_type == b'cursor':
+                    payload = int(payload)
+                    self.player.set_cursor(timestamp=payload)
+                elif command_type == b'transform':
+                    self.player.transform_playback(transform=TimelineTransform.parse(payload))
                 else:
                     raise InvalidCommand()
-            except CommandIsNotAvailable:
-                response = {'type': 'COMMAND_NOT_AVAILABLE'}
-                self.client_socket.sendall(json.dumps(response).encode())
-            except InvalidCommand:
-                response = {'type': 'INVALID_COMMAND'}
-                self.client_socket.sendall(json.dumps(response).encode())
             else:
-                response = {'type': 'COMPLETED'}
-                self.client_socket.sendall(json.dumps(response).encode())
-        self.player.next()
+                raise InvalidCommand()
+        except CommandIsNotAvailable:
+            response = {'type': 'COMMAND_NOT_AVAILABLE'}
+            self.client_socket.sendall(json.dumps(response).encode())
+        except InvalidCommand:
+            response = {'type': 'INVALID_COMMAND'}
+            self.client_socket.sendall(json.dumps(response).encode())
+        else:
+            response = {'type': 'COMPLETED'}
+            self.client_socket.sendall(json.dumps(response).encode())
+
+    def fileno(self) -> int:
+        return self.client_socket.fileno()
+
+    def attach(self, token: bytes):
+        if not token:
+            raise InvalidCommand()
+        if self.is_anonymous and token not in self.player_registry.players:
+            self.player_registry.rename(token=self.token, new_token=token)
+        else:
+            self.release()
+            self.player = self.player_registry.attach(token=token)
+        self.token = token
+        self.is_anonymous = False
+
+    def close(self):
+        self.client_socket.close()
+        self.release()
+
+    def release(self):
+        """
+        К анонимному плейеру после отключения уже никто не подключится,
+        поэтому он удаляется, а не продолжает занимать устройство вывода
+        """
+        if self.is_anonymous or self.player.playback is None:
+            self.player_registry.remove(token=self.token)
+        else:
+            self.player_registry.detach(token=self.token)
 
 
 class SocketSessionFactory(SessionFactory):
-    def __init__(self, host: str, port: int):
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            idle_timeout: float = PLAYER_IDLE_TIMEOUT,
+            status_observer: SharedMemoryStatusObserver | None = None,
+            recorder: SessionRecorder | None = None,
+            clock: Clock | None = None
+    ):
         self.server_socket = socket.create_server((host, port), reuse_port=True)
         self.server_socket.settimeout(0)
         self.server_socket.listen()
+        self.recorder = recorder
+        self.clock = clock
+        self.monitor_socket = None
+        self.status_observer = status_observer
+        self.player_registry = PlayerRegistry(
+            player_factory=self.create_player,
+            idle_timeout=idle_timeout
+        )
+        if status_observer is not None:
+            self.player_registry.add_observer(observer=status_observer)
 
     def create_session(self) -> Session:
         try:
             client_socket, _ = self.server_socket.accept()
-            monitor_socket = socket.create_connection((MOCK_MONITOR_SOCKET_HOST, MOCK_MONITOR_SOCKET_PORT))
             print('Подключено', _)
+            if self.recorder is not None:
+                self.recorder.record(kind=RecordKind.CONNECT)
+                client_socket = RecordingSocket(
+                    client_socket=client_socket,
+                    recorder=self.recorder,
+                    read_kind=RecordKind.COMMAND,
+                    send_kind=RecordKind.RESPONSE
+                )
             return SocketSession(
                 client_socket=client_socket,
-                player=Player(
-                    playback_factory=TextPlaybackBuilder(
-                        monitor_socket=monitor_socket
-                    )
-                )
+                player_registry=self.player_registry
             )
         except BlockingIOError:
             raise SessionFactoryError()
+
+    def fileno(self) -> int:
+        return self.server_socket.fileno()
+
+    def next(self):
+        self.player_registry.next()
+
+    def get_wait_time(self, max_wait_time: float) -> float:
+        return self.player_registry.get_wait_time(max_wait_time=max_wait_time)
+
+    def stop(self):
+        self.server_socket.close()
+
+    def close(self):
+        self.server_socket.close()
+        if self.monitor_socket is not None:
+            self.monitor_socket.close()
+        if self.status_observer is not None:
+            self.status_observer.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def create_player(self) -> Player:
+        return Player(
+            playback_factory=TextPlaybackBuilder(
+                monitor_socket=self.get_monitor_socket(),
+                clock=self.clock
+            )
+        )
+
+    def get_monitor_socket(self) -> socket.socket:
+        if self.monitor_socket is None:
+            self.monitor_socket = socket.create_connection((MOCK_MONITOR_SOCKET_HOST, MOCK_MONITOR_SOCKET_PORT))
+            if self.recorder is not None:
+                self.monitor_socket = RecordingSocket(
+                    client_socket=self.monitor_socket,
+                    recorder=self.recorder,
+                    read_kind=RecordKind.MONITOR,
+                    send_kind=RecordKind.MONITOR
+                )
+        return self.monitor_socket
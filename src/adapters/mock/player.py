@@ -1,9 +1,12 @@
-import dataclasses
 import json
 import socket
-import time
 
+import numpy as np
+
+from src.domain.exceptions import PlaybackIsFinished
 from src.domain.player import Action, Playback, PlaybackFactory
+from src.domain.timeline import ActionTimeline, TimelineTransform
+from src.generic.clock import Clock
 from src.generic.observer import Observer
 
 
@@ -34,15 +37,23 @@ class KaraokeTextPrintAction(Action):
 
 
 class SilenceAction(Action):
-    def __init__(self, timestamp, ms: int):
+    """
+    Пауза до времени трека deadline. Плейбек не выполнит ее раньше срока,
+    поэтому само действие ничего не делает и не блокирует поток
+    """
+
+    def __init__(self, timestamp, deadline: int):
         self.timestamp = timestamp
-        self.ms = ms
+        self.deadline = deadline
 
     def get_timestamp(self) -> int:
         return self.timestamp
 
+    def get_deadline(self) -> int:
+        return self.deadline
+
     def execute(self):
-        time.sleep(self.ms / 1000)
+        pass
 
 
 class TimelineNotifyObserver(Observer):
@@ -51,7 +62,10 @@ class TimelineNotifyObserver(Observer):
         self.prev_timestamp = None
 
     def update(self, observable: Playback):
-        current_timestamp = observable.get_current_timestamp()
+        try:
+            current_timestamp = observable.get_current_timestamp()
+        except PlaybackIsFinished:
+            return
         if current_timestamp != self.prev_timestamp:
             self.notify(timestamp=current_timestamp)
             self.prev_timestamp = current_timestamp
@@ -66,52 +80,86 @@ class TimelineNotifyObserver(Observer):
         self.client_socket.send(json.dumps(notification).encode())
 
 
-@dataclasses.dataclass
-class ActionTimeline:
-    start: int
-    duration: int
-    action: Action
+class EventTimeline(ActionTimeline):
+    """
+    Действия плейбека по массивам событий. event_indices - номера событий
+    в events, timestamps - их таймстемпы по возрастанию. У одинаковых
+    событий одинаковый event_ids
+    """
+
+    def __init__(
+            self,
+            monitor_socket: socket.socket,
+            events: list[tuple[bytes, bytes]],
+            event_ids: np.ndarray,
+            event_indices: np.ndarray,
+            timestamps: np.ndarray
+    ):
+        super().__init__(timestamps=timestamps, deadlines=timestamps)
+        self.monitor_socket = monitor_socket
+        self.events = events
+        self.event_ids = event_ids
+        self.event_indices = event_indices
+
+    def create_action(self, group: int) -> Action:
+        command_type, text = self.events[self.event_indices[group]]
+        timestamp = int(self.timestamps[group])
+        if command_type == b'':
+            return PrintAction(timestamp=timestamp, text=str(text))
+        return KaraokeTextPrintAction(client_socket=self.monitor_socket, timestamp=timestamp, text=str(text))
+
+    def create_silence(self, timestamp: int, deadline: int) -> Action:
+        return SilenceAction(timestamp=timestamp, deadline=deadline)
 
 
 class TextPlaybackBuilder(PlaybackFactory):
-    def __init__(self, monitor_socket: socket.socket):
+    def __init__(self, monitor_socket: socket.socket, clock: Clock | None = None):
         self.monitor_socket = monitor_socket
+        self.clock = clock
 
     def create_playback(self, payload: bytes) -> Playback:
-        action_timelines = []
-        actions = []
-        cursor = 0
+        events = []
+        timestamps = []
         for command in payload.split(b'&'):
             timestamp, command_type, command = command.split(b':', maxsplit=2)
-            if command_type == b'':
-                action = PrintAction(
-                    timestamp=int(timestamp),
-                    text=str(command)
-                )
-            else:
-                action = KaraokeTextPrintAction(
-                    client_socket=self.monitor_socket,
-                    timestamp=int(timestamp),
-                    text=str(command)
-                )
-            action_timeline = ActionTimeline(
-                start=int(timestamp),
-                duration=0,
-                action=action
-            )
-            action_timelines.append(action_timeline)
-
-        for action_timeline in sorted(action_timelines, key=lambda x: x.start):
-            start = action_timeline.start
-            silence_duration = start - cursor
-            if silence_duration:
-                silence_action = SilenceAction(
-                    timestamp=cursor,
-                    ms=silence_duration
-                )
-                actions.append(silence_action)
-            actions.append(action_timeline.action)
-            cursor = start + action_timeline.duration
-        playback = Playback(actions=actions)
+            events.append((command_type, command))
+            timestamps.append(int(timestamp))
+        timestamps = np.array(timestamps, dtype=np.int64)
+        order = np.argsort(timestamps, kind='stable')
+        event_ids = {}
+        timeline = EventTimeline(
+            monitor_socket=self.monitor_socket,
+            events=events,
+            event_ids=np.fromiter(
+                (event_ids.setdefault(event, len(event_ids)) for event in events),
+                dtype=np.int64,
+                count=len(events)
+            ),
+            event_indices=order,
+            timestamps=timestamps[order]
+        )
+        playback = Playback(actions=timeline, clock=self.clock)
         playback.add_observer(observer=TimelineNotifyObserver(client_socket=self.monitor_socket))
         return playback
+
+    def transform_playback(self, playback: Playback, transform: TimelineTransform):
+        timeline: EventTimeline = playback.actions
+        indices, timestamps = transform.apply(
+            timestamps=timeline.timestamps,
+            keys=timeline.event_ids[timeline.event_indices]
+        )
+        try:
+            cursor_timestamp = int(transform.map(np.array([playback.get_current_timestamp()]))[0])
+        except PlaybackIsFinished:
+            cursor_timestamp = None
+        playback.actions = EventTimeline(
+            monitor_socket=self.monitor_socket,
+            events=timeline.events,
+            event_ids=timeline.event_ids,
+            event_indices=timeline.event_indices[indices],
+            timestamps=timestamps
+        )
+        if cursor_timestamp is None:
+            playback.cursor = len(playback.actions)
+        else:
+            playback.set_cursor(timestamp=cursor_timestamp)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import dataclasses
+import enum
+import socket
+import struct
+from typing import Iterator
+
+import serial
+
+from src.generic.clock import Clock, SystemClock
+
+RECORDING_MAGIC = b'RNRR\x01'
+
+# Запись: время от начала прогона в наносекундах, тип, длина данных.
+# Каждый прогон сервера начинается с записи START со скоростью UART
+RECORD_HEADER = struct.Struct('<qBI')
+START_BODY = struct.Struct('<I')
+
+
+class RecordKind(enum.Enum):
+    CONNECT = 0
+    DISCONNECT = 1
+    COMMAND = 2
+    RESPONSE = 3
+    UART = 4
+    MONITOR = 5
+    START = 6
+
+
+@dataclasses.dataclass
+class Record:
+    timestamp_ns: int
+    kind: RecordKind
+    data: bytes
+
+
+class SessionRecorder:
+    """
+    Дописывает в файл входящие команды, ответы и весь вывод в UART и монитор
+    с метками монотонного времени часов clock. Время отсчитывается от начала
+    прогона, поэтому при дописывании в существующий файл новый прогон
+    открывается записью START. baudrate - скорость UART, 0 - неизвестна
+    """
+
+    def __init__(self, path: str, baudrate: int = 0, clock: Clock | None = None):
+        self.clock = clock or SystemClock()
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(RECORDING_MAGIC)
+        self.start_ns = self.clock.monotonic_ns()
+        self.record(kind=RecordKind.START, data=START_BODY.pack(baudrate))
+
+    def record(self, kind: RecordKind, data: bytes = b''):
+        self.file.write(RECORD_HEADER.pack(self.clock.monotonic_ns() - self.start_ns, kind.value, len(data)))
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def read_records(path: str) -> Iterator[Record]:
+    with open(path, 'rb') as file:
+        if file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f'{path} is not a session recording')
+        while True:
+            header = file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp_ns, kind, length = RECORD_HEADER.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                return
+            yield Record(timestamp_ns=timestamp_ns, kind=RecordKind(kind), data=data)
+
+
+def read_runs(path: str) -> list[list[Record]]:
+    """
+    Делит записи файла на прогоны сервера. У каждого прогона своя шкала времени
+    """
+    runs = []
+    for record in read_records(path=path):
+        if record.kind == RecordKind.START or not runs:
+            runs.append([])
+        runs[-1].append(record)
+    return runs
+
+
+def get_baudrate(records: list[Record]) -> int | None:
+    """
+    Скорость UART прогона из записи START, None - если не записана
+    """
+    for record in records:
+        if record.kind == RecordKind.START and len(record.data) == START_BODY.size:
+            [baudrate] = START_BODY.unpack(record.data)
+            return baudrate or None
+    return None
+
+
+class RecordingSocket:
+    """
+    Обертка над сокетом: все, что прочитано, записывается как read_kind,
+    все, что отправлено, - как send_kind
+    """
+
+    def __init__(
+            self,
+            client_socket: socket.socket,
+            recorder: SessionRecorder,
+            read_kind: RecordKind,
+            send_kind: RecordKind
+    ):
+        self.client_socket = client_socket
+        self.recorder = recorder
+        self.read_kind = read_kind
+        self.send_kind = send_kind
+
+    def fileno(self) -> int:
+        return self.client_socket.fileno()
+
+    def recv(self, bufsize: int) -> bytes:
+        data = self.client_socket.recv(bufsize)
+        if data == b'':
+            self.recorder.record(kind=RecordKind.DISCONNECT)
+        else:
+            self.recorder.record(kind=self.read_kind, data=data)
+        return data
+
+    def send(self, data: bytes) -> int:
+        sent = self.client_socket.send(data)
+        self.recorder.record(kind=self.send_kind, data=data[:sent])
+        return sent
+
+    def sendall(self, data: bytes):
+        self.client_socket.sendall(data)
+        self.recorder.record(kind=self.send_kind, data=data)
+
+    def close(self):
+        self.client_socket.close()
+
+
+class RecordingSerial:
+    def __init__(self, uart_client: serial.Serial, recorder: SessionRecorder):
+        self.uart_client = uart_client
+        self.recorder = recorder
+
+    @property
+    def out_waiting(self) -> int:
+        return self.uart_client.out_waiting
+
+    def write(self, data) -> int:
+        written = self.uart_client.write(data)
+        self.recorder.record(kind=RecordKind.UART, data=bytes(data))
+        return written
@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import ctypes
+import dataclasses
+import os
+import struct
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from src.domain.exceptions import PlaybackIsFinished
+from src.domain.player import Player, PlayerRegistry, PlayerStateType
+from src.generic.observer import Observer
+
+STATUS_MAGIC = b'RNRS'
+STATUS_SLOTS_COUNT = 16
+NO_VALUE = -1
+# Сколько раз читатель перечитывает слот, прежде чем счесть его устаревшим
+SLOT_READ_RETRIES = 1000
+EMPTY_SLOT_BODY = (b'', NO_VALUE, NO_VALUE, NO_VALUE, NO_VALUE)
+
+# Заголовок: сигнатура, количество слотов, pid процесса-владельца.
+# Слот: счетчик последовательности, токен сессии, состояние, текущий таймстемп,
+# последний таймстемп, индекс действия. Нечетный счетчик означает, что слот
+# в процессе записи
+HEADER = struct.Struct('<4sIq')
+SEQUENCE = struct.Struct('<Q')
+SLOT_BODY = struct.Struct('<32sqqqq')
+SLOT_SIZE = SEQUENCE.size + SLOT_BODY.size
+
+
+@dataclasses.dataclass
+class PlayerStatus:
+    """
+    is_stale - слот не удалось прочитать целиком: писатель остановился
+    посреди записи. Тогда поля содержат последнее прочитанное значение
+    """
+
+    token: bytes
+    state: PlayerStateType | None
+    current_timestamp: int | None
+    last_timestamp: int | None
+    action_index: int | None
+    is_stale: bool = False
+
+
+class SharedMemoryStatusObserver(Observer):
+    """
+    Публикует состояние плейеров реестра в сегменте shared memory.
+    Каждый слот защищен счетчиком последовательности, поэтому читатели
+    обходятся без блокировок, а сервер не делает системных вызовов
+    """
+
+    def __init__(self, name: str, slots_count: int = STATUS_SLOTS_COUNT):
+        size = HEADER.size + SLOT_SIZE * slots_count
+        try:
+            self.shared_memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self.remove_stale_segment(name=name)
+            self.shared_memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.slots_count = slots_count
+        self.slots: dict[bytes, int] = {}
+        self.free_slots = list(reversed(range(slots_count)))
+        self.sequences = [0] * slots_count
+        self.bodies: list[tuple | None] = [None] * slots_count
+        HEADER.pack_into(self.shared_memory.buf, 0, STATUS_MAGIC, slots_count, os.getpid())
+        for slot in range(slots_count):
+            self.write_slot(slot=slot, body=EMPTY_SLOT_BODY)
+
+    @staticmethod
+    def remove_stale_segment(name: str):
+        """
+        Удаляет сегмент, оставшийся от завершившегося процесса.
+        Сегмент живого сервера не трогает
+        """
+        stale_memory = shared_memory.SharedMemory(name=name)
+        owner_pid = NO_VALUE
+        if stale_memory.size >= HEADER.size:
+            magic, _, owner_pid = HEADER.unpack_from(stale_memory.buf, 0)
+            if magic != STATUS_MAGIC:
+                owner_pid = NO_VALUE
+        if owner_pid != NO_VALUE and is_process_alive(pid=owner_pid):
+            stale_memory.close()
+            resource_tracker.unregister(stale_memory._name, 'shared_memory')
+            raise FileExistsError(f'{name} is owned by running process {owner_pid}')
+        stale_memory.close()
+        stale_memory.unlink()
+
+    def update(self, observable: PlayerRegistry):
+        for token in list(self.slots):
+            if token not in observable.players:
+                slot = self.slots.pop(token)
+                self.write_slot(slot=slot, body=EMPTY_SLOT_BODY)
+                self.free_slots.append(slot)
+        for token, player in observable.players.items():
+            slot = self.slots.get(token)
+            if slot is None:
+                if not self.free_slots:
+                    continue
+                slot = self.free_slots.pop()
+                self.slots[token] = slot
+            self.write_slot(slot=slot, body=self.get_player_body(token=token, player=player))
+
+    @staticmethod
+    def get_player_body(token: bytes, player: Player) -> tuple:
+        playback = player.playback
+        if playback is None:
+            return token[:32], player.state_type.value, NO_VALUE, NO_VALUE, NO_VALUE
+        try:
+            current_timestamp = playback.get_current_timestamp()
+        except PlaybackIsFinished:
+            current_timestamp = NO_VALUE
+        last_timestamp = playback.get_last_timestamp() if playback.actions else NO_VALUE
+        return token[:32], player.state_type.value, current_timestamp, last_timestamp, playback.cursor
+
+    def write_slot(self, slot: int, body: tuple):
+        if self.bodies[slot] == body:
+            return
+        offset = HEADER.size + SLOT_SIZE * slot
+        sequence = self.sequences[slot]
+        SEQUENCE.pack_into(self.shared_memory.buf, offset, sequence + 1)
+        SLOT_BODY.pack_into(self.shared_memory.buf, offset + SEQUENCE.size, *body)
+        SEQUENCE.pack_into(self.shared_memory.buf, offset, sequence + 2)
+        self.sequences[slot] = sequence + 2
+        self.bodies[slot] = body
+
+    def close(self):
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+
+class HeartbeatObserver(Observer):
+    """
+    Отмечает время каждого шага реестра в памяти, общей с супервизором.
+    Если отметка долго не меняется, обработчик завис
+    """
+
+    def __init__(self, heartbeat: ctypes.c_double):
+        self.heartbeat = heartbeat
+
+    def update(self, observable: PlayerRegistry):
+        self.heartbeat.value = time.monotonic()
+
+
+class SharedMemoryStatusReader:
+    def __init__(self, name: str):
+        if sys.version_info >= (3, 13):
+            self.shared_memory = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            self.shared_memory = shared_memory.SharedMemory(name=name)
+            # Иначе resource_tracker удалит чужой сегмент при выходе читателя
+            resource_tracker.unregister(self.shared_memory._name, 'shared_memory')
+        magic, self.slots_count, self.owner_pid = HEADER.unpack_from(self.shared_memory.buf, 0)
+        if magic != STATUS_MAGIC:
+            self.shared_memory.close()
+            raise ValueError(f'{name} is not a player status segment')
+        self.last_bodies = [EMPTY_SLOT_BODY] * self.slots_count
+
+    def read(self) -> list[PlayerStatus]:
+        statuses = []
+        for slot in range(self.slots_count):
+            body = self.read_slot(slot=slot)
+            is_stale = body is None
+            if is_stale:
+                body = self.last_bodies[slot]
+            token, state, current_timestamp, last_timestamp, action_index = body
+            if state == NO_VALUE and not is_stale:
+                continue
+            statuses.append(
+                PlayerStatus(
+                    token=token.rstrip(b'\0'),
+                    state=None if state == NO_VALUE else PlayerStateType(state),
+                    current_timestamp=None if current_timestamp == NO_VALUE else current_timestamp,
+                    last_timestamp=None if last_timestamp == NO_VALUE else last_timestamp,
+                    action_index=None if action_index == NO_VALUE else action_index,
+                    is_stale=is_stale
+                )
+            )
+        return statuses
+
+    def read_slot(self, slot: int) -> tuple | None:
+        """
+        Возвращает None, если за SLOT_READ_RETRIES попыток слот ни разу не
+        оказался в согласованном состоянии
+        """
+        offset = HEADER.size + SLOT_SIZE * slot
+        for _ in range(SLOT_READ_RETRIES):
+            [sequence] = SEQUENCE.unpack_from(self.shared_memory.buf, offset)
+            if sequence % 2:
+                continue
+            body = SLOT_BODY.unpack_from(self.shared_memory.buf, offset + SEQUENCE.size)
+            if SEQUENCE.unpack_from(self.shared_memory.buf, offset) == (sequence,):
+                self.last_bodies[slot] = body
+                return body
+        return None
+
+    def close(self):
+        self.shared_memory.close()
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
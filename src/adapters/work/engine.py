@@ -1,88 +1,185 @@
 import json
-import select
 import socket
+import uuid
+
 from serial import Serial
 
+from src.adapters.recording import RecordKind, RecordingSerial, RecordingSocket, SessionRecorder
+from src.adapters.status import SharedMemoryStatusObserver
 from src.domain.engine import SessionFactory, Session
 from src.domain.exceptions import SessionFactoryError, SessionIsClosed, CommandIsNotAvailable, InvalidCommand
-from src.domain.player import Player
+from src.domain.player import Player, PlayerRegistry
+from src.domain.timeline import TimelineTransform
+from src.generic.clock import Clock
 from .player import TextPlaybackBuilder
+from .scheduler import BandwidthScheduler
+
+PLAYER_IDLE_TIMEOUT = 300
 
 
 class SocketSession(Session):
-    def __init__(self, client_socket: socket.socket, player: Player):
+    def __init__(self, client_socket: socket.socket, player_registry: PlayerRegistry):
         self.client_socket = client_socket
-        self.player = player
+        self.player_registry = player_registry
+        self.token = uuid.uuid4().hex.encode()
+        self.is_anonymous = True
+        self.player = self.player_registry.attach(token=self.token)
 
     def next(self):
-        message = self.read_socket()
-        if message is None:
-            self.player.next()
-        else:
-            message = message.split(b':', maxsplit=1)
-            try:
-                if len(message) == 1:
-                    [command_type] = message
-                    if command_type == b'clear':
-                        self.player.clear_playback()
-                    elif command_type == b'play':
-                        self.player.play()
-                    elif command_type == b'pause':
-                        self.player.pause()
-                    elif command_type == b'stop':
-                        self.player.stop()
-                    else:
-                        raise InvalidCommand()
-                elif len(message) == 2:
-                    command_type, payload = message
-                    if command_type == b'load':
-                        self.player.load_playback(source=payload)
-                    elif command_type == b'cursor':
-                        payload = int(payload)
-                        self.player.set_cursor(timestamp=payload)
-                    else:
-                        raise InvalidCommand()
+        try:
+            message = self.read_socket()
+        except SessionIsClosed:
+            self.close()
+            raise
+        message = message.split(b':', maxsplit=1)
+        try:
+            if len(message) == 1:
+                [command_type] = message
+                if command_type == b'clear':
+                    self.player.clear_playback()
+                elif command_type == b'play':
+                    self.player.play()
+                elif command_type == b'pause':
+                    self.player.pause()
+                elif command_type == b'stop':
+                    self.player.stop()
+                else:
+                    raise InvalidCommand()
+            elif len(message) == 2:
+                command_type, payload = message
+                if command_type == b'session':
+                    self.attach(token=payload)
+                elif command_type == b'load':
+                    self.player.load_playback(source=payload)
+                elif command_type == b'cursor':
+                    payload = int(payload)
+                    self.player.set_cursor(timestamp=payload)
+                elif command_type == b'transform':
+                    self.player.transform_playback(transform=TimelineTransform.parse(payload))
                 else:
                     raise InvalidCommand()
-            except CommandIsNotAvailable:
-                response = {'type': 'COMMAND_NOT_AVAILABLE'}
-                self.client_socket.sendall(json.dumps(response).encode())
-            except InvalidCommand:
-                response = {'type': 'INVALID_COMMAND'}
-                self.client_socket.sendall(json.dumps(response).encode())
-            except SessionIsClosed:
-                self.client_socket.close()
-                raise
             else:
-                response = {'type': 'COMPLETED'}
-                self.client_socket.sendall(json.dumps(response).encode())
+                raise InvalidCommand()
+        except CommandIsNotAvailable:
+            response = {'type': 'COMMAND_NOT_AVAILABLE'}
+            self.client_socket.sendall(json.dumps(response).encode())
+        except InvalidCommand:
+            response = {'type': 'INVALID_COMMAND'}
+            self.client_socket.sendall(json.dumps(response).encode())
+        else:
+            response = {'type': 'COMPLETED'}
+            self.client_socket.sendall(json.dumps(response).encode())
+
+    def fileno(self) -> int:
+        return self.client_socket.fileno()
+
+    def attach(self, token: bytes):
+        if not token:
+            raise InvalidCommand()
+        if self.is_anonymous and token not in self.player_registry.players:
+            self.player_registry.rename(token=self.token, new_token=token)
+        else:
+            self.release()
+            self.player = self.player_registry.attach(token=token)
+        self.token = token
+        self.is_anonymous = False
+
+    def close(self):
+        self.client_socket.close()
+        self.release()
+
+    def release(self):
+        """
+        К анонимному плейеру после отключения уже никто не подключится,
+        поэтому он удаляется, а не продолжает занимать устройство вывода
+        """
+        if self.is_anonymous or self.player.playback is None:
+            self.player_registry.remove(token=self.token)
+        else:
+            self.player_registry.detach(token=self.token)
 
-    def read_socket(self):
-        to_read, _, _ = select.select([self.client_socket], [], [], 0)
-        if self.client_socket in to_read:
-            message = self.client_socket.recv(4096)
-            if message == b'':
-                raise SessionIsClosed()
-            return message
+    def read_socket(self) -> bytes:
+        message = self.client_socket.recv(4096)
+        if message == b'':
+            raise SessionIsClosed()
+        return message
 
 
 class SocketSessionFactory(SessionFactory):
-    def __init__(self, server_socket: socket.socket, uart_client: Serial, monitor_socket: socket.socket):
+    def __init__(
+            self,
+            server_socket: socket.socket,
+            uart_client: Serial,
+            monitor_socket: socket.socket,
+            idle_timeout: float = PLAYER_IDLE_TIMEOUT,
+            status_observer: SharedMemoryStatusObserver | None = None,
+            recorder: SessionRecorder | None = None,
+            clock: Clock | None = None,
+            scheduler: BandwidthScheduler | None = None
+    ):
         self.server_socket = server_socket
-        self.uart_client = uart_client
-        self.monitor_socket = monitor_socket
+        self.recorder = recorder
+        self.clock = clock
+        self.scheduler = scheduler
+        if recorder is None:
+            self.uart_client = uart_client
+            self.monitor_socket = monitor_socket
+        else:
+            self.uart_client = RecordingSerial(uart_client=uart_client, recorder=recorder)
+            self.monitor_socket = RecordingSocket(
+                client_socket=monitor_socket,
+                recorder=recorder,
+                read_kind=RecordKind.MONITOR,
+                send_kind=RecordKind.MONITOR
+            )
+        self.status_observer = status_observer
+        self.player_registry = PlayerRegistry(
+            player_factory=self.create_player,
+            idle_timeout=idle_timeout
+        )
+        if status_observer is not None:
+            self.player_registry.add_observer(observer=status_observer)
 
     def create_session(self) -> Session:
         try:
             client_socket, _ = self.server_socket.accept()
+            if self.recorder is not None:
+                self.recorder.record(kind=RecordKind.CONNECT)
+                client_socket = RecordingSocket(
+                    client_socket=client_socket,
+                    recorder=self.recorder,
+                    read_kind=RecordKind.COMMAND,
+                    send_kind=RecordKind.RESPONSE
+                )
             return SocketSession(
                 client_socket=client_socket,
-                player=Player(
-                    playback_factory=TextPlaybackBuilder(
-                        uart_client=self.uart_client,
-                        monitor_socket=self.monitor_socket
-                    )
-                )
+                player_registry=self.player_registry
             )
         except BlockingIOError:
             raise SessionFactoryError()
+
+    def fileno(self) -> int:
+        return self.server_socket.fileno()
+
+    def next(self):
+        self.player_registry.next()
+
+    def get_wait_time(self, max_wait_time: float) -> float:
+        return self.player_registry.get_wait_time(max_wait_time=max_wait_time)
+
+    def stop(self):
+        self.server_socket.close()
+
+    def close(self):
+        if self.status_observer is not None:
+            self.status_observer.close()
+
+    def create_player(self) -> Player:
+        return Player(
+            playback_factory=TextPlaybackBuilder(
+                uart_client=self.uart_client,
+                monitor_socket=self.monitor_socket,
+                clock=self.clock,
+                scheduler=self.scheduler
+            )
+        )
@@ -1,39 +1,96 @@
+from __future__ import annotations
+
 import json
 import socket
-import time
 
+import numpy as np
 import serial
 
+from src.domain.exceptions import PlaybackIsFinished
 from src.domain.player import Action, Playback, PlaybackFactory
+from src.domain.timeline import ActionTimeline, TimelineTransform
+from src.generic.clock import Clock
 from src.generic.observer import Observer
+from .scheduler import BandwidthScheduler, ScheduledBurst
 
+# То же, что json.dumps уведомления, но без кодирования словаря на каждую отправку
+TIMELINE_CHANGED_NOTIFICATION = '{"type": "TIMELINE_CHANGED", "payload": {"current_timestamp": %d}}'
+
+
+class CompiledTrack:
+    """
+    Все кадры трека, готовые к отправке по UART, в одном непрерывном буфере.
+    Кадр i занимает байты offsets[i]:offsets[i + 1]. У одинаковых кадров
+    одинаковый frame_ids
+    """
 
-class UARTSendAction(Action):
     FINISH_MARKER = b'\n'
 
-    def __init__(self, uart_client: serial.Serial, timestamp: int, payload: bytes):
+    def __init__(self, payloads: list[bytes], priorities: list[int]):
+        self.priorities = np.array(priorities, dtype=np.int64)
+        payload_ids = {}
+        self.frame_ids = np.fromiter(
+            (payload_ids.setdefault(payload, len(payload_ids)) for payload in payloads),
+            dtype=np.int64,
+            count=len(payloads)
+        )
+        self.is_prioritized = bool(self.priorities.any())
+        self.buffer = self.FINISH_MARKER.join(payloads) + self.FINISH_MARKER if payloads else b''
+        self.offsets = np.zeros(len(payloads) + 1, dtype=np.int64)
+        np.cumsum(
+            np.fromiter((len(payload) for payload in payloads), dtype=np.int64, count=len(payloads))
+            + len(self.FINISH_MARKER),
+            out=self.offsets[1:]
+        )
+        self.view = memoryview(self.buffer)
+
+    def get_frames(self, start: int, end: int) -> memoryview:
+        return self.view[self.offsets[start]:self.offsets[end]]
+
+    def get_size(self, start: int, end: int) -> int:
+        return int(self.offsets[end] - self.offsets[start])
+
+    def get_sizes(self, indices: np.ndarray) -> np.ndarray:
+        return self.offsets[indices + 1] - self.offsets[indices]
+
+
+class UARTSendAction(Action):
+    """
+    Отправляет подряд идущие кадры скомпилированного трека одной записью.
+    timestamp - таймстемп отправки в треке, send_time - запланированное время отправки
+    """
+
+    def __init__(self, uart_client: serial.Serial, timestamp: int, send_time: int, frames: memoryview):
         self.uart_client = uart_client
         self.timestamp = timestamp
-        self.payload = payload
+        self.send_time = send_time
+        self.frames = frames
 
     def get_timestamp(self) -> int:
         return self.timestamp
 
     def execute(self):
-        print(f'Sending {self.payload}')
-        self.uart_client.write(self.payload + self.FINISH_MARKER)
+        self.uart_client.write(self.frames)
 
 
 class SilenceAction(Action):
-    def __init__(self, timestamp, ms: int):
+    """
+    Пауза до времени трека deadline. Плейбек не выполнит ее раньше срока,
+    поэтому само действие ничего не делает и не блокирует поток
+    """
+
+    def __init__(self, timestamp, deadline: int):
         self.timestamp = timestamp
-        self.ms = ms
+        self.deadline = deadline
 
     def get_timestamp(self) -> int:
         return self.timestamp
 
+    def get_deadline(self) -> int:
+        return self.deadline
+
     def execute(self):
-        time.sleep(self.ms / 1000)
+        pass
 
 
 class TimelineNotifyObserver(Observer):
@@ -42,53 +99,278 @@ class TimelineNotifyObserver(Observer):
         self.prev_timestamp = None
 
     def update(self, observable: Playback):
-        current_timestamp = observable.get_current_timestamp()
+        try:
+            current_timestamp = observable.get_current_timestamp()
+        except PlaybackIsFinished:
+            return
         if current_timestamp != self.prev_timestamp:
             self.notify(timestamp=current_timestamp)
             self.prev_timestamp = current_timestamp
 
     def notify(self, timestamp: int):
+        self.client_socket.send((TIMELINE_CHANGED_NOTIFICATION % timestamp).encode())
+
+
+class BurstLatenessObserver(Observer):
+    """
+    Оценивает фактическое опоздание кадров пачки по часам плейбека и очереди
+    передачи порта и после ее последней отправки сообщает монитору
+    предсказанное и фактическое. Измерение начинается заново с первой
+    отправки пачки, поэтому каждый проход трека оценивается отдельно
+    """
+
+    def __init__(self, client_socket: socket.socket, uart_client: serial.Serial, scheduler: BandwidthScheduler):
+        self.client_socket = client_socket
+        self.uart_client = uart_client
+        self.scheduler = scheduler
+        self.prev_cursor = 0
+
+    def update(self, observable: Playback):
+        cursor = observable.cursor
+        if cursor == self.prev_cursor + 1:
+            timeline: UARTTimeline = observable.actions
+            group = int(timeline.groups[cursor - 1])
+            burst_index = timeline.get_burst_index(group=group)
+            if burst_index >= 0:
+                burst = timeline.bursts[burst_index]
+                if timeline.get_burst_index(group=group - 1) != burst_index:
+                    burst.actual_lateness_ms = None
+                burst.actual_lateness_ms = max(
+                    burst.actual_lateness_ms or 0.0,
+                    self.measure(timeline=timeline, group=group, elapsed_ms=observable.get_elapsed_ms())
+                )
+                if timeline.get_burst_index(group=group + 1) != burst_index:
+                    self.notify(burst=burst)
+        self.prev_cursor = cursor
+
+    def measure(self, timeline: UARTTimeline, group: int, elapsed_ms: float) -> float:
+        """
+        Наибольшее опоздание кадров записи group. elapsed_ms - время трека
+        в момент записи. Кадр уходит в линию, когда из очереди порта передано
+        все, что записано перед ним
+        """
+        queued_size = self.uart_client.out_waiting - int(timeline.byte_ends[group] - timeline.byte_starts[group])
+        return elapsed_ms + max(
+            self.scheduler.get_duration_ms(size=queued_size) + float(timeline.group_lateness_ms[group]),
+            -float(timeline.group_first_timestamps[group])
+        )
+
+    def notify(self, burst: ScheduledBurst):
         notification = {
-            'type': 'TIMELINE_CHANGED',
-            'payload': {
-                'current_timestamp': timestamp,
-            }
+            'type': 'BURST_LATENESS',
+            'payload': vars(burst)
         }
         self.client_socket.send(json.dumps(notification).encode())
 
 
+class UARTTimeline(ActionTimeline):
+    """
+    Отправки по UART по массивам кадров. frame_indices и frame_timestamps -
+    кадры в порядке трека, send_indices и send_timestamps - в порядке отправки,
+    group_starts - позиции в порядке отправки, с которых начинается каждая
+    отправка. Таймстемп отправки - таймстемп ее первого кадра, время отправки
+    задает только длину пауз. Отправка g пишет байты буфера
+    byte_starts[g]:byte_ends[g].
+    group_bursts - номер пачки отправки или -1, None - если пачек нет.
+    group_first_timestamps - наименьший таймстемп кадров отправки,
+    group_lateness_ms - наибольшее опоздание ее кадров относительно момента
+    записи, если очередь порта перед записью пуста
+    """
+
+    def __init__(
+            self,
+            uart_client: serial.Serial,
+            track: CompiledTrack,
+            frame_indices: np.ndarray,
+            frame_timestamps: np.ndarray,
+            send_indices: np.ndarray,
+            send_timestamps: np.ndarray,
+            group_starts: np.ndarray,
+            group_timestamps: np.ndarray,
+            send_times: np.ndarray,
+            group_bursts: np.ndarray | None = None,
+            group_first_timestamps: np.ndarray | None = None,
+            group_lateness_ms: np.ndarray | None = None,
+            bursts: list[ScheduledBurst] | None = None
+    ):
+        super().__init__(timestamps=group_timestamps, deadlines=send_times)
+        self.uart_client = uart_client
+        self.track = track
+        self.frame_indices = frame_indices
+        self.frame_timestamps = frame_timestamps
+        self.send_indices = send_indices
+        self.send_timestamps = send_timestamps
+        self.group_starts = group_starts
+        group_ends = np.append(group_starts[1:], len(send_indices))
+        self.byte_starts = track.offsets[send_indices[group_starts]]
+        self.byte_ends = track.offsets[send_indices[group_ends - 1] + 1]
+        self.group_bursts = group_bursts
+        self.group_first_timestamps = group_first_timestamps
+        self.group_lateness_ms = group_lateness_ms
+        self.bursts = bursts or []
+
+    def execute_group(self, group: int):
+        self.uart_client.write(self.track.view[self.byte_starts[group]:self.byte_ends[group]])
+
+    def create_action(self, group: int) -> Action:
+        return UARTSendAction(
+            uart_client=self.uart_client,
+            timestamp=int(self.timestamps[group]),
+            send_time=int(self.deadlines[group]),
+            frames=self.track.view[self.byte_starts[group]:self.byte_ends[group]]
+        )
+
+    def get_burst_index(self, group: int) -> int:
+        if self.group_bursts is None or not 0 <= group < len(self.group_bursts):
+            return -1
+        return int(self.group_bursts[group])
+
+    def create_silence(self, timestamp: int, deadline: int) -> Action:
+        return SilenceAction(timestamp=timestamp, deadline=deadline)
+
+
 class TextPlaybackBuilder(PlaybackFactory):
-    def __init__(self, uart_client: serial.Serial, monitor_socket: socket.socket):
+    def __init__(
+            self,
+            uart_client: serial.Serial,
+            monitor_socket: socket.socket,
+            clock: Clock | None = None,
+            scheduler: BandwidthScheduler | None = None
+    ):
         self.uart_client = uart_client
         self.monitor_socket = monitor_socket
+        self.clock = clock
+        self.scheduler = scheduler
 
     def create_playback(self, payload: bytes) -> Playback:
-        active_commands = []
+        commands = []
         for command in payload.strip(b'#').split(b'#'):
             timestamp, command = command.split(b'.', maxsplit=1)
-            action = UARTSendAction(
-                uart_client=self.uart_client,
-                timestamp=int(timestamp),
-                payload=command
-            )
-            active_commands.append(action)
-        actions = []
-        cursor = 0
-        for active_command in sorted(active_commands, key=lambda x: x.get_timestamp()):
-            command_timestamp = active_command.get_timestamp()
-            silence_duration = command_timestamp - cursor
-            if silence_duration:
-                silence_action = SilenceAction(
-                    timestamp=cursor,
-                    ms=silence_duration
-                )
-                actions.append(silence_action)
-            actions.append(active_command)
-            cursor = command_timestamp
-        playback = Playback(actions=actions)
+            timestamp, _, priority = timestamp.partition(b':')
+            commands.append((int(timestamp), int(priority or 0), command))
+        commands.sort(key=lambda x: (x[0], -x[1]))
+        track = CompiledTrack(
+            payloads=[command for _, _, command in commands],
+            priorities=[priority for _, priority, _ in commands]
+        )
+        timeline = self.build_timeline(
+            track=track,
+            frame_indices=np.arange(len(commands), dtype=np.int64),
+            timestamps=np.fromiter((timestamp for timestamp, _, _ in commands), dtype=np.int64, count=len(commands))
+        )
+        playback = Playback(actions=timeline, clock=self.clock)
         playback.add_observer(
             observer=TimelineNotifyObserver(
                 client_socket=self.monitor_socket
             )
         )
+        if self.scheduler is not None:
+            playback.add_observer(
+                observer=BurstLatenessObserver(
+                    client_socket=self.monitor_socket,
+                    uart_client=self.uart_client,
+                    scheduler=self.scheduler
+                )
+            )
         return playback
+
+    def transform_playback(self, playback: Playback, transform: TimelineTransform):
+        timeline: UARTTimeline = playback.actions
+        indices, timestamps = transform.apply(
+            timestamps=timeline.frame_timestamps,
+            keys=timeline.track.frame_ids[timeline.frame_indices],
+            priorities=timeline.track.priorities[timeline.frame_indices]
+        )
+        try:
+            cursor_timestamp = int(transform.map(np.array([playback.get_current_timestamp()]))[0])
+        except PlaybackIsFinished:
+            cursor_timestamp = None
+        playback.actions = self.build_timeline(
+            track=timeline.track,
+            frame_indices=timeline.frame_indices[indices],
+            timestamps=timestamps
+        )
+        if cursor_timestamp is None:
+            playback.cursor = len(playback.actions)
+        else:
+            playback.set_cursor(timestamp=cursor_timestamp)
+
+    def build_timeline(self, track: CompiledTrack, frame_indices: np.ndarray, timestamps: np.ndarray) -> UARTTimeline:
+        """
+        frame_indices и timestamps - кадры трека, отсортированные по таймстемпу.
+        Соседние в буфере кадры, которые уходят в одно время или одной пачкой,
+        объединяются в одну отправку. Кадры разных пачек не объединяются
+        """
+        if track.is_prioritized:
+            priorities = track.priorities[frame_indices]
+            if np.any((timestamps[1:] == timestamps[:-1]) & (priorities[1:] > priorities[:-1])):
+                order = np.lexsort((-priorities, timestamps))
+                frame_indices = frame_indices[order]
+                timestamps = timestamps[order]
+        send_indices = frame_indices
+        send_timestamps = timestamps
+        if self.scheduler is None:
+            send_times = timestamps
+            burst_indices = None
+        else:
+            sizes = track.get_sizes(frame_indices)
+            schedule = self.scheduler.schedule(
+                timestamps=timestamps,
+                sizes=sizes,
+                priorities=track.priorities[frame_indices]
+            )
+            if schedule.order is not None:
+                send_indices = frame_indices[schedule.order]
+                send_timestamps = timestamps[schedule.order]
+                sizes = sizes[schedule.order]
+            send_times = np.floor(schedule.send_times).astype(np.int64)
+            burst_indices = schedule.burst_indices
+        together = np.diff(send_times) == 0
+        if burst_indices is not None:
+            together = np.where(
+                burst_indices[1:] >= 0,
+                burst_indices[1:] == burst_indices[:-1],
+                together & (burst_indices[:-1] < 0)
+            )
+        starts = np.ones(len(send_indices), dtype=bool)
+        starts[1:] = ~(together & (np.diff(send_indices) == 1))
+        group_starts = np.flatnonzero(starts)
+        if self.scheduler is None or not len(group_starts):
+            return UARTTimeline(
+                uart_client=self.uart_client,
+                track=track,
+                frame_indices=frame_indices,
+                frame_timestamps=timestamps,
+                send_indices=send_indices,
+                send_timestamps=send_timestamps,
+                group_starts=group_starts,
+                group_timestamps=send_timestamps[group_starts],
+                send_times=send_times[group_starts]
+            )
+        group_sizes = np.diff(group_starts, append=len(send_indices))
+        group_first_timestamps = np.minimum.reduceat(send_timestamps, group_starts)
+        group_timestamps = group_first_timestamps
+        if schedule.order is not None:
+            # Приоритетный кадр мог обогнать более ранние, а шкала не должна убывать
+            group_timestamps = np.minimum.accumulate(group_first_timestamps[::-1])[::-1]
+        # Байты отправки, которые уходят в линию перед каждым ее кадром
+        sizes_before = np.cumsum(sizes) - sizes
+        sizes_before -= np.repeat(sizes_before[group_starts], group_sizes)
+        return UARTTimeline(
+            uart_client=self.uart_client,
+            track=track,
+            frame_indices=frame_indices,
+            frame_timestamps=timestamps,
+            send_indices=send_indices,
+            send_timestamps=send_timestamps,
+            group_starts=group_starts,
+            group_timestamps=group_timestamps,
+            send_times=send_times[group_starts],
+            group_bursts=burst_indices[group_starts],
+            group_first_timestamps=group_first_timestamps,
+            group_lateness_ms=np.maximum.reduceat(
+                sizes_before / self.scheduler.bytes_per_ms - send_timestamps,
+                group_starts
+            ),
+            bursts=schedule.bursts
+        )
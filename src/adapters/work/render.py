@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import dataclasses
+
+from src.domain.exceptions import PlaybackIsFinished
+from src.domain.player import Player, PlayerStateType
+from src.generic.clock import VirtualClock
+from .player import CompiledTrack, TextPlaybackBuilder
+from .scheduler import UART_BAUDRATE, UART_BITS_PER_BYTE, BandwidthScheduler, ScheduledBurst
+
+DENSITY_WINDOW_MS = 1000
+# Опоздания меньше миллисекунды - погрешность округления времени отправки
+LATENESS_TOLERANCE_MS = 1.0
+
+
+@dataclasses.dataclass
+class RenderedOutput:
+    timestamp_ms: float
+    data: bytes
+
+
+@dataclasses.dataclass
+class Burst:
+    """
+    Подряд идущие отправки, которые застали линию занятой
+    """
+
+    start_ms: float
+    end_ms: float
+    writes: int
+    size: int
+    max_delay_ms: float
+
+
+@dataclasses.dataclass
+class RenderResult:
+    uart_output: list[RenderedOutput]
+    monitor_output: list[RenderedOutput]
+    duration_ms: float
+    peak_density: int
+    bursts: list[Burst]
+    scheduled_bursts: list[ScheduledBurst]
+
+
+class RenderSerial:
+    """
+    Записывает вывод и моделирует очередь передачи порта для out_waiting
+    """
+
+    def __init__(self, clock: VirtualClock, baudrate: int = UART_BAUDRATE):
+        self.clock = clock
+        self.bytes_per_ms = baudrate / UART_BITS_PER_BYTE / 1000
+        self.line_free_ms = 0.0
+        self.output: list[RenderedOutput] = []
+
+    @property
+    def out_waiting(self) -> int:
+        return max(round((self.line_free_ms - self.clock.monotonic_ns() / 1e6) * self.bytes_per_ms), 0)
+
+    def write(self, data) -> int:
+        timestamp_ms = self.clock.monotonic_ns() / 1e6
+        self.line_free_ms = max(self.line_free_ms, timestamp_ms) + len(data) / self.bytes_per_ms
+        self.output.append(RenderedOutput(timestamp_ms=timestamp_ms, data=bytes(data)))
+        return len(data)
+
+
+class RenderSocket:
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.output: list[RenderedOutput] = []
+
+    def send(self, data: bytes) -> int:
+        self.sendall(data)
+        return len(data)
+
+    def sendall(self, data: bytes):
+        self.output.append(RenderedOutput(timestamp_ms=self.clock.monotonic_ns() / 1e6, data=bytes(data)))
+
+
+def render(
+        payload: bytes,
+        baudrate: int = UART_BAUDRATE,
+        scheduler: BandwidthScheduler | None = None
+) -> RenderResult:
+    """
+    Проигрывает трек до конца на виртуальных часах и возвращает весь вывод
+    в UART и монитор с таймстемпами
+    """
+    clock = VirtualClock()
+    uart_client = RenderSerial(clock=clock, baudrate=baudrate)
+    monitor_socket = RenderSocket(clock=clock)
+    player = Player(
+        playback_factory=TextPlaybackBuilder(
+            uart_client=uart_client,
+            monitor_socket=monitor_socket,
+            clock=clock,
+            scheduler=scheduler
+        )
+    )
+    player.load_playback(source=payload)
+    while player.state_type == PlayerStateType.PLAYING:
+        try:
+            clock.sleep(player.playback.get_wait_time())
+        except PlaybackIsFinished:
+            pass
+        player.next()
+    return RenderResult(
+        uart_output=uart_client.output,
+        monitor_output=monitor_socket.output,
+        duration_ms=clock.monotonic_ns() / 1e6,
+        peak_density=get_peak_density(uart_output=uart_client.output),
+        bursts=find_bursts(uart_output=uart_client.output, baudrate=baudrate),
+        scheduled_bursts=player.playback.actions.bursts
+    )
+
+
+def get_peak_density(uart_output: list[RenderedOutput], window_ms: float = DENSITY_WINDOW_MS) -> int:
+    """
+    Наибольшее количество кадров, отправленных в любом окне длиной window_ms
+    """
+    peak = 0
+    frames = 0
+    start = 0
+    for output in uart_output:
+        frames += output.data.count(CompiledTrack.FINISH_MARKER)
+        while uart_output[start].timestamp_ms <= output.timestamp_ms - window_ms:
+            frames -= uart_output[start].data.count(CompiledTrack.FINISH_MARKER)
+            start += 1
+        peak = max(peak, frames)
+    return peak
+
+
+def find_bursts(uart_output: list[RenderedOutput], baudrate: int = UART_BAUDRATE) -> list[Burst]:
+    """
+    Моделирует очередь передачи на линии и возвращает группы отправок,
+    которые ушли позже своего таймстемпа из-за нехватки пропускной способности
+    """
+    bytes_per_ms = baudrate / UART_BITS_PER_BYTE / 1000
+    bursts = []
+    burst = None
+    head = None
+    line_free_ms = 0.0
+    for output in uart_output:
+        start_ms = max(output.timestamp_ms, line_free_ms)
+        delay_ms = start_ms - output.timestamp_ms
+        if delay_ms > LATENESS_TOLERANCE_MS:
+            if burst is None:
+                burst = Burst(start_ms=head.timestamp_ms, end_ms=0, writes=1, size=len(head.data), max_delay_ms=0)
+                bursts.append(burst)
+            burst.writes += 1
+            burst.size += len(output.data)
+            burst.max_delay_ms = max(burst.max_delay_ms, delay_ms)
+        else:
+            burst = None
+            head = output
+        line_free_ms = start_ms + len(output.data) / bytes_per_ms
+        if burst is not None:
+            burst.end_ms = line_free_ms
+    return bursts
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import dataclasses
+import heapq
+
+import numpy as np
+
+UART_BAUDRATE = 115200
+# 8N1: старт-бит, 8 бит данных, стоп-бит
+UART_BITS_PER_BYTE = 10
+MAX_LEAD_MS = 100
+# Кадры, между которыми меньше этого времени, идут в линию без паузы
+BACK_TO_BACK_TOLERANCE_MS = 1e-6
+
+
+@dataclasses.dataclass
+class ScheduledBurst:
+    """
+    Кадры, которые по плану уходят в линию без пауз между собой
+    """
+
+    timestamp: int
+    frames: int
+    size: int
+    predicted_lateness_ms: float
+    actual_lateness_ms: float | None = None
+
+
+@dataclasses.dataclass
+class Schedule:
+    """
+    order - индексы кадров в порядке отправки, None - если порядок не изменился.
+    send_times и burst_indices - время отправки и номер пачки (-1 - вне пачки)
+    кадров в порядке отправки
+    """
+
+    order: np.ndarray | None
+    send_times: np.ndarray
+    bursts: list[ScheduledBurst]
+    burst_indices: np.ndarray
+
+
+class BandwidthScheduler:
+    """
+    Планирует время отправки кадров с учетом пропускной способности UART.
+    Кадры, которые не успеют уйти вовремя, отправляются заранее, но не раньше
+    чем за max_lead_ms до своего таймстемпа. Внутри пачки кадр с более высоким
+    приоритетом обгоняет ждущие в очереди кадры с более низким, как только его
+    можно отправить заранее, поэтому опоздание ложится на менее важные кадры
+    """
+
+    def __init__(self, baudrate: int = UART_BAUDRATE, max_lead_ms: int = MAX_LEAD_MS):
+        self.bytes_per_ms = baudrate / UART_BITS_PER_BYTE / 1000
+        self.max_lead_ms = max_lead_ms
+
+    def get_duration_ms(self, size: int) -> float:
+        return size / self.bytes_per_ms
+
+    def schedule(self, timestamps: np.ndarray, sizes: np.ndarray, priorities: np.ndarray) -> Schedule:
+        """
+        timestamps, sizes и priorities - кадры по возрастанию таймстемпа,
+        кадры с одним таймстемпом - по убыванию приоритета
+        """
+        durations = sizes / self.bytes_per_ms
+        # Время начала кадра, если передавать все кадры подряд с нуля
+        line_offsets = np.cumsum(durations) - durations
+        # Самое позднее время, при котором этот и все следующие кадры успевают
+        # к своим таймстемпам, но не раньше max_lead_ms до таймстемпа
+        latest_times = line_offsets + np.minimum.accumulate((timestamps - line_offsets)[::-1])[::-1]
+        earliest_times = np.maximum(timestamps - self.max_lead_ms, 0)
+        release_times = np.maximum(latest_times, earliest_times)
+        # Кадр ждет, пока линия занята предыдущими
+        delays = np.maximum.accumulate(release_times - line_offsets)
+        send_times = line_offsets + delays
+        order = None
+
+        run_starts = np.flatnonzero(np.diff(delays, prepend=-np.inf) > BACK_TO_BACK_TOLERANCE_MS)
+        run_sizes = np.diff(run_starts, append=len(timestamps))
+        is_burst = run_sizes > 1
+        burst_starts = run_starts[is_burst]
+        burst_ends = burst_starts + run_sizes[is_burst]
+        bursts = []
+        burst_indices = np.full(len(timestamps), -1, dtype=np.int64)
+        if len(burst_starts):
+            is_mixed = (
+                np.maximum.reduceat(priorities, run_starts)[is_burst]
+                != np.minimum.reduceat(priorities, run_starts)[is_burst]
+            )
+            for start, end in zip(burst_starts[is_mixed].tolist(), burst_ends[is_mixed].tolist()):
+                if order is None:
+                    order = np.arange(len(timestamps))
+                self.reorder_burst(
+                    start=start,
+                    end=end,
+                    earliest_times=earliest_times,
+                    durations=durations,
+                    priorities=priorities,
+                    order=order,
+                    send_times=send_times
+                )
+            run_bursts = np.full(len(run_starts), -1, dtype=np.int64)
+            run_bursts[is_burst] = np.arange(len(burst_starts))
+            burst_indices = np.repeat(run_bursts, run_sizes)
+            lateness = np.maximum(send_times - (timestamps if order is None else timestamps[order]), 0.0)
+            bursts = [
+                ScheduledBurst(timestamp=timestamp, frames=frames, size=size, predicted_lateness_ms=predicted_lateness_ms)
+                for timestamp, frames, size, predicted_lateness_ms in zip(
+                    timestamps[burst_starts].tolist(),
+                    run_sizes[is_burst].tolist(),
+                    np.add.reduceat(sizes, run_starts)[is_burst].tolist(),
+                    np.maximum.reduceat(lateness, run_starts)[is_burst].tolist()
+                )
+            ]
+        return Schedule(order=order, send_times=send_times, bursts=bursts, burst_indices=burst_indices)
+
+    @staticmethod
+    def reorder_burst(
+            start: int,
+            end: int,
+            earliest_times: np.ndarray,
+            durations: np.ndarray,
+            priorities: np.ndarray,
+            order: np.ndarray,
+            send_times: np.ndarray
+    ):
+        """
+        Переставляет кадры пачки start:end: когда линия освобождается, из кадров,
+        которые уже можно отправить заранее, первым уходит самый приоритетный.
+        Плановое время тут не подходит: в перегруженной пачке у менее важных
+        кадров оно раньше, и важный кадр не успел бы их обогнать
+        """
+        ready = []
+        position = start
+        send_time = float(send_times[start])
+        for slot in range(start, end):
+            while position < end and earliest_times[position] <= send_time + BACK_TO_BACK_TOLERANCE_MS:
+                heapq.heappush(ready, (-int(priorities[position]), position))
+                position += 1
+            if not ready:
+                send_time = float(earliest_times[position])
+                heapq.heappush(ready, (-int(priorities[position]), position))
+                position += 1
+            _, index = heapq.heappop(ready)
+            order[slot] = index
+            send_times[slot] = send_time
+            send_time += float(durations[index])
@@ -0,0 +1,33 @@
+import os
+import select
+
+import serial
+from serial.serialutil import Timeout
+
+
+class UARTSerial(serial.Serial):
+    """
+    Порт, который пишет переданный буфер без копирования. Serial.write
+    превращает memoryview в bytes, а кадры трека уже лежат в одном буфере,
+    поэтому запись идет напрямую в дескриптор с дозаписью остатка
+    """
+
+    def write(self, data) -> int:
+        if not self.is_open:
+            raise serial.PortNotOpenError()
+        view = memoryview(data).cast('B')
+        size = view.nbytes
+        timeout = Timeout(self._write_timeout)
+        while view:
+            try:
+                written = os.write(self.fd, view)
+            except BlockingIOError:
+                written = 0
+            if timeout.is_non_blocking:
+                return written
+            view = view[written:]
+            if view:
+                _, ready, _ = select.select([], [self.fd], [], timeout.time_left())
+                if not ready:
+                    raise serial.SerialTimeoutException('Write timeout')
+        return size
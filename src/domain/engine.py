@@ -4,42 +4,116 @@ import abc
 from typing import Iterable
 
 from src.domain.exceptions import SessionIsClosed, SessionFactoryError
+from src.generic.clock import Clock, SystemClock
 
+# Ожидая команды и подключения, Engine просыпается не реже, чтобы удалять
+# брошенные плейеры и обновлять статус
+MAX_WAIT_TIME = 1.0
 
-class Session(abc.ABC):
-    def run(self):
-        while True:
-            try:
-                self.next()
-            except SessionIsClosed:
-                break
 
+class Session(abc.ABC):
     @abc.abstractmethod
     def next(self):
+        """
+        Выполняет команду клиента. Engine вызывает его, когда сокет сессии
+        готов к чтению
+        """
+
+    @abc.abstractmethod
+    def fileno(self) -> int:
         ...
 
 
 class SessionFactory(abc.ABC):
     @abc.abstractmethod
     def create_session(self) -> Session:
+        """
+        Принимает подключение. Engine вызывает его, когда слушающий сокет
+        готов к чтению
+        """
+
+    @abc.abstractmethod
+    def fileno(self) -> int:
         ...
 
+    @abc.abstractmethod
+    def next(self):
+        """
+        Продвигает плейеры фабрики
+        """
+
+    @abc.abstractmethod
+    def get_wait_time(self, max_wait_time: float) -> float:
+        """
+        Сколько секунд можно не вызывать next, но не больше max_wait_time
+        """
+
+    def stop(self):
+        """
+        Прекращает прием новых подключений
+        """
+
+    def close(self):
+        """
+        Освобождает ресурсы фабрики после остановки Engine
+        """
+
 
 class Engine:
-    def __init__(self, session_factories: Iterable[SessionFactory]):
+    """
+    Обслуживает все подключенные сессии одновременно: ждет готовности
+    слушающих и клиентских сокетов до срока ближайшего действия плейеров
+    """
+
+    def __init__(self, session_factories: Iterable[SessionFactory], clock: Clock | None = None):
         self.session_factories = list(session_factories)
         assert self.session_factories, 'session_factories cannot be empty'
+        self.clock = clock or SystemClock()
+        self.sessions: list[Session] = []
+        self.is_running = False
 
     def run(self):
-        while True:
-            session = self.create_session()
-            session.run()
+        self.is_running = True
+        try:
+            while self.is_running:
+                self.next()
+            for session_factory in self.session_factories:
+                session_factory.stop()
+            while self.sessions:
+                self.next()
+        finally:
+            for session_factory in self.session_factories:
+                session_factory.close()
 
-    def create_session(self) -> Session:
-        cursor = 0
-        while True:
-            session_factory = self.session_factories[cursor % len(self.session_factories)]
-            try:
-                return session_factory.create_session()
-            except SessionFactoryError:
-                cursor += 1
+    def stop(self):
+        """
+        Прекращает прием новых сессий: на следующем шаге Engine закрывает
+        слушающие сокеты, чтобы ядро не ставило в очередь подключения
+        к останавливающемуся Engine. Можно вызывать из обработчика сигнала.
+        Текущие сессии дорабатывают до отключения клиентов
+        """
+        self.is_running = False
+
+    def next(self):
+        session_factories = self.session_factories if self.is_running else []
+        ready = self.clock.wait(sockets=[*session_factories, *self.sessions], timeout=self.get_wait_time())
+        for session in list(self.sessions):
+            if session in ready:
+                try:
+                    session.next()
+                except SessionIsClosed:
+                    self.sessions.remove(session)
+        for session_factory in session_factories:
+            if session_factory in ready:
+                try:
+                    self.sessions.append(session_factory.create_session())
+                except SessionFactoryError:
+                    pass
+        for session_factory in self.session_factories:
+            session_factory.next()
+
+    def get_wait_time(self) -> float:
+        return min(
+            session_factory.get_wait_time(max_wait_time=MAX_WAIT_TIME)
+            for session_factory in self.session_factories
+        )
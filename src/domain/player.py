@@ -1,10 +1,13 @@
 from __future__ import annotations
 
 import abc
-import bisect
 import enum
+import time
+from typing import Callable
 
 from src.domain.exceptions import PlaybackIsFinished, CommandIsNotAvailable
+from src.domain.timeline import ActionTimeline, TimelineTransform
+from src.generic.clock import Clock, SystemClock
 from src.generic.observer import Observable, Observer
 
 
@@ -17,36 +20,90 @@ class Action(abc.ABC):
     def execute(self):
         ...
 
+    def get_deadline(self) -> int | None:
+        """
+        Время трека в мс, раньше которого действие не выполняется
+        """
+        return None
+
 
 class Playback(Observable, abc.ABC):
-    def __init__(self, actions: list[Action]):
+    """
+    Воспроизводит действия по часам clock. Действие, чей срок еще не наступил,
+    не блокирует поток: execute_action просто ничего не делает
+    """
+
+    def __init__(self, actions: ActionTimeline, clock: Clock | None = None):
         self.actions = actions
         self.cursor = 0
         self.observers = set()
+        self.clock = clock or SystemClock()
+        self.origin_ns = None
+        self.position_ns = 0
 
     def execute_action(self):
-        action = self.get_current_action()
-        action.execute()
-        self.cursor += 1
-        self.notify_observers()
+        """
+        Выполняет подряд все действия, чей срок уже наступил
+        """
+        elapsed_ms = self.get_elapsed_ns() // 1_000_000
+        actions = self.actions
+        while self.cursor < len(actions):
+            deadline = actions.get_deadline(self.cursor)
+            if deadline is not None and deadline > elapsed_ms:
+                return
+            actions.execute(self.cursor)
+            self.cursor += 1
+            self.notify_observers()
+        raise PlaybackIsFinished()
+
+    def get_elapsed_ns(self) -> int:
+        """
+        Текущее время трека по часам. Считается в целых наносекундах, чтобы
+        ожидание до срока действия не сводилось к погрешности округления
+        """
+        if self.origin_ns is None:
+            self.origin_ns = self.clock.monotonic_ns() - self.position_ns
+        return self.clock.monotonic_ns() - self.origin_ns
+
+    def get_elapsed_ms(self) -> float:
+        return self.get_elapsed_ns() / 1_000_000
+
+    def get_wait_time(self) -> float:
+        """
+        Сколько секунд осталось до срока текущего действия
+        """
+        deadline = self.actions.get_deadline(self.get_current_index())
+        if deadline is None:
+            return 0.0
+        return max(deadline * 1_000_000 - self.get_elapsed_ns(), 0) / 1e9
 
-    def get_current_action(self) -> Action:
-        try:
-            return self.actions[self.cursor]
-        except IndexError:
+    def pause(self):
+        if self.origin_ns is not None:
+            self.position_ns = self.get_elapsed_ns()
+            self.origin_ns = None
+
+    def get_current_index(self) -> int:
+        if self.cursor >= len(self.actions):
             raise PlaybackIsFinished()
+        return self.cursor
+
+    def get_current_action(self) -> Action:
+        return self.actions[self.get_current_index()]
 
     def set_cursor(self, timestamp: int):
-        self.cursor = bisect.bisect_left(self.actions, timestamp, key=lambda action: action.get_timestamp())
+        self.cursor = self.actions.find(timestamp)
+        self.origin_ns = None
+        try:
+            self.position_ns = self.get_current_timestamp() * 1_000_000
+        except PlaybackIsFinished:
+            self.position_ns = 0
         self.notify_observers()
 
     def get_current_timestamp(self) -> int:
-        current_action = self.get_current_action()
-        return current_action.get_timestamp()
+        return self.actions.get_timestamp(self.get_current_index())
 
     def get_last_timestamp(self) -> int:
-        last_action = self.actions[-1]
-        return last_action.get_timestamp()
+        return self.actions.get_timestamp(len(self.actions) - 1)
 
     def add_observer(self, observer: Observer) -> None:
         self.observers.add(observer)
@@ -63,6 +120,9 @@ class PlaybackFactory:
     def create_playback(self, payload: bytes) -> Playback:
         ...
 
+    def transform_playback(self, playback: Playback, transform: TimelineTransform):
+        ...
+
 
 class PlaybackBuilder(abc.ABC):
     """
@@ -98,7 +158,8 @@ class Player:
             PlayerStateType.PAUSED: PauseState(player=self),
             PlayerStateType.NO_PLAYBACK: NoPlaybackState(player=self)
         }
-        self.state: PlayerState = self.states[PlayerStateType.NO_PLAYBACK]
+        self.state_type = PlayerStateType.NO_PLAYBACK
+        self.state: PlayerState = self.states[self.state_type]
         self.playback = None
 
     def load_playback(self, source: bytes):
@@ -119,7 +180,17 @@ class Player:
     def set_cursor(self, timestamp: int):
         self.state.set_cursor(timestamp=timestamp)
 
+    def transform_playback(self, transform: TimelineTransform):
+        self.state.transform_playback(transform=transform)
+
+    def get_wait_time(self) -> float | None:
+        """
+        Сколько секунд до срока текущего действия, None - если плейер не играет
+        """
+        return self.state.get_wait_time()
+
     def set_state(self, state_type: PlayerStateType):
+        self.state_type = state_type
         self.state = self.states[state_type]
 
     def __iter__(self):
@@ -154,6 +225,12 @@ class PlayerState(abc.ABC):
     def set_cursor(self, timestamp: int):
         raise CommandIsNotAvailable()
 
+    def transform_playback(self, transform: TimelineTransform):
+        raise CommandIsNotAvailable()
+
+    def get_wait_time(self) -> float | None:
+        return None
+
     @abc.abstractmethod
     def next(self):
         ...
@@ -171,6 +248,7 @@ class PlayingState(PlayerState):
         self.next()
 
     def pause(self):
+        self.player.playback.pause()
         self.player.set_state(state_type=PlayerStateType.PAUSED)
 
     def stop(self):
@@ -180,6 +258,15 @@ class PlayingState(PlayerState):
     def set_cursor(self, timestamp: int):
         self.player.playback.set_cursor(timestamp=timestamp)
 
+    def transform_playback(self, transform: TimelineTransform):
+        self.player.playback_factory.transform_playback(playback=self.player.playback, transform=transform)
+
+    def get_wait_time(self) -> float | None:
+        try:
+            return self.player.playback.get_wait_time()
+        except PlaybackIsFinished:
+            return 0.0
+
     def next(self):
         try:
             self.player.playback.execute_action()
@@ -209,6 +296,9 @@ class PauseState(PlayerState):
     def set_cursor(self, timestamp: int):
         self.player.playback.set_cursor(timestamp=timestamp)
 
+    def transform_playback(self, transform: TimelineTransform):
+        self.player.playback_factory.transform_playback(playback=self.player.playback, transform=transform)
+
     def next(self):
         pass
 
@@ -220,3 +310,90 @@ class NoPlaybackState(PlayerState):
 
     def next(self):
         pass
+
+
+class PlayerRegistry(Observable):
+    """
+    Хранит плейеры между подключениями клиента. Плейер привязывается к токену
+    сессии, поэтому при переподключении клиент возвращается к загруженному
+    треку и курсору. Отключенные плейеры продолжают воспроизведение и
+    удаляются, если к ним не подключались дольше idle_timeout секунд.
+    Все плейеры реестра пишут в одно устройство вывода, поэтому играть может
+    только один: запущенный последним ставит остальные на паузу
+    """
+
+    def __init__(self, player_factory: Callable[[], Player], idle_timeout: float):
+        self.player_factory = player_factory
+        self.idle_timeout = idle_timeout
+        self.players: dict[bytes, Player] = {}
+        self.detached_at: dict[bytes, float] = {}
+        self.playing_token: bytes | None = None
+        self.observers = set()
+
+    def attach(self, token: bytes) -> Player:
+        player = self.players.get(token)
+        if player is None:
+            player = self.player_factory()
+            self.players[token] = player
+        self.detached_at.pop(token, None)
+        return player
+
+    def detach(self, token: bytes):
+        if token in self.players:
+            self.detached_at[token] = time.monotonic()
+
+    def rename(self, token: bytes, new_token: bytes):
+        self.players[new_token] = self.players.pop(token)
+        self.detached_at.pop(token, None)
+        if self.playing_token == token:
+            self.playing_token = new_token
+
+    def remove(self, token: bytes):
+        self.players.pop(token, None)
+        self.detached_at.pop(token, None)
+
+    def next(self):
+        self.remove_idle_players()
+        self.pause_displaced_players()
+        for player in list(self.players.values()):
+            player.next()
+        self.notify_observers()
+
+    def get_wait_time(self, max_wait_time: float) -> float:
+        """
+        Сколько секунд можно не вызывать next: до срока ближайшего действия
+        играющих плейеров, но не больше max_wait_time
+        """
+        wait_times = [player.get_wait_time() for player in self.players.values()]
+        return min([wait_time for wait_time in wait_times if wait_time is not None] + [max_wait_time])
+
+    def pause_displaced_players(self):
+        playing_tokens = [
+            token for token, player in self.players.items()
+            if player.state_type == PlayerStateType.PLAYING
+        ]
+        started_tokens = [token for token in playing_tokens if token != self.playing_token]
+        if started_tokens:
+            self.playing_token = started_tokens[-1]
+        elif self.playing_token not in playing_tokens:
+            self.playing_token = None
+        for token in playing_tokens:
+            if token != self.playing_token:
+                self.players[token].pause()
+
+    def remove_idle_players(self):
+        now = time.monotonic()
+        for token, detached_at in list(self.detached_at.items()):
+            if now - detached_at >= self.idle_timeout:
+                del self.detached_at[token]
+                del self.players[token]
+
+    def add_observer(self, observer: Observer) -> None:
+        self.observers.add(observer)
+
+    def remove_observer(self, observer: Observer) -> None:
+        self.observers.discard(observer)
+
+    def notify_observers(self) -> None:
+        for observer in self.observers:
+            observer.update(observable=self)
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import abc
+import collections.abc
+import dataclasses
+import math
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from src.domain.exceptions import InvalidCommand
+
+if TYPE_CHECKING:
+    from src.domain.player import Action
+
+# Наибольший таймстемп в мс, время которого в наносекундах еще помещается в int64
+MAX_TIMESTAMP = np.iinfo(np.int64).max // 1_000_000
+NO_DEADLINE = -1
+
+
+@dataclasses.dataclass
+class TimelineTransform:
+    """
+    Массовое преобразование временной шкалы трека. Все операции выполняются
+    за один векторный проход по колонке таймстемпов:
+    растяжение, сдвиг, привязка к сетке, обрезка и удаление дублей.
+    Дубль - событие с тем же таймстемпом и тем же содержимым
+    """
+
+    shift: int = 0
+    scale: float = 1.0
+    quantize: int = 0
+    clip_start: int | None = None
+    clip_end: int | None = None
+    dedupe: bool = False
+
+    @classmethod
+    def parse(cls, payload: bytes) -> TimelineTransform:
+        """
+        Формат: shift=100,scale=1.5,quantize=40,clip=0-60000,dedupe
+        """
+        transform = cls()
+        try:
+            for option in payload.split(b','):
+                name, _, value = option.partition(b'=')
+                if name == b'shift':
+                    transform.shift = int(value)
+                elif name == b'scale':
+                    transform.scale = float(value)
+                elif name == b'quantize':
+                    transform.quantize = int(value)
+                elif name == b'clip':
+                    start, end = value.split(b'-')
+                    transform.clip_start = int(start) if start else None
+                    transform.clip_end = int(end) if end else None
+                elif name == b'dedupe' and not value:
+                    transform.dedupe = True
+                else:
+                    raise InvalidCommand()
+        except ValueError:
+            raise InvalidCommand()
+        if not math.isfinite(transform.scale) or transform.scale <= 0 or transform.quantize < 0:
+            raise InvalidCommand()
+        bounds = [transform.shift, transform.quantize, transform.clip_start, transform.clip_end]
+        if any(abs(value) > MAX_TIMESTAMP for value in bounds if value is not None):
+            raise InvalidCommand()
+        return transform
+
+    def map(self, timestamps: np.ndarray) -> np.ndarray:
+        """
+        Новые таймстемпы. Если они выходят за MAX_TIMESTAMP, преобразование
+        отклоняется, а не переполняет int64
+        """
+        if self.scale == 1 and not self.quantize:
+            result = np.maximum(timestamps + self.shift, 0)
+        else:
+            result = timestamps * self.scale + self.shift
+            if self.quantize:
+                result = np.round(result / self.quantize) * self.quantize
+            result = np.maximum(result, 0)
+        if len(result) and result.max() > MAX_TIMESTAMP:
+            raise InvalidCommand()
+        return result.astype(np.int64, copy=False)
+
+    def apply(
+            self,
+            timestamps: np.ndarray,
+            keys: np.ndarray,
+            priorities: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Принимает отсортированные таймстемпы событий, keys - номера содержимого
+        событий (одинаковое содержимое - один номер) и их приоритеты.
+        Возвращает индексы оставшихся событий и их новые таймстемпы
+        """
+        result = self.map(timestamps)
+        if self.clip_start is None and self.clip_end is None and not self.dedupe:
+            return np.arange(len(result)), result
+        mask = np.ones(len(result), dtype=bool)
+        if self.clip_start is not None:
+            mask &= result >= self.clip_start
+        if self.clip_end is not None:
+            mask &= result <= self.clip_end
+        if self.dedupe:
+            mask &= self.find_unique(timestamps=result, keys=keys, priorities=priorities)
+        return np.flatnonzero(mask), result[mask]
+
+    @staticmethod
+    def find_unique(timestamps: np.ndarray, keys: np.ndarray, priorities: np.ndarray | None = None) -> np.ndarray:
+        """
+        Маска событий без дублей. Из дублей остается событие с наибольшим
+        приоритетом, при равных - первое. Сортируются только события,
+        чей таймстемп совпадает с соседним
+        """
+        mask = np.ones(len(timestamps), dtype=bool)
+        same = timestamps[1:] == timestamps[:-1]
+        if not same.any():
+            return mask
+        candidates = np.flatnonzero(np.append(same, False) | np.insert(same, 0, False))
+        # Номер группы одинаковых таймстемпов и номер содержимого в одном ключе
+        runs = np.cumsum(np.insert(~same, 0, False))[candidates]
+        candidate_keys = keys[candidates]
+        combined = runs * (int(candidate_keys.max()) + 1) + candidate_keys
+        order = np.argsort(combined, kind='stable')
+        sorted_combined = combined[order]
+        kept = np.flatnonzero(np.insert(sorted_combined[1:] != sorted_combined[:-1], 0, True))
+        if priorities is not None:
+            sorted_priorities = priorities[candidates][order]
+            group_max = np.repeat(np.maximum.reduceat(sorted_priorities, kept), np.diff(kept, append=len(order)))
+            best = np.flatnonzero(sorted_priorities == group_max)
+            kept = best[np.insert(sorted_combined[best][1:] != sorted_combined[best][:-1], 0, True)]
+        mask[candidates] = False
+        mask[candidates[order[kept]]] = True
+        return mask
+
+
+class ActionTimeline(collections.abc.Sequence, abc.ABC):
+    """
+    Действия плейбека, построенные по массивам. Группа - одно действие трека,
+    перед группой, чей срок отличается от срока предыдущей, вставляется пауза.
+    Плейбек выполняет действия по номеру прямо по массивам, не создавая
+    объектов. Объекты Action создаются только при обращении по индексу
+    """
+
+    def __init__(self, timestamps: np.ndarray, deadlines: np.ndarray):
+        """
+        timestamps - таймстемпы групп, deadlines - время трека, раньше которого группа не выполняется
+        """
+        self.timestamps = timestamps
+        self.deadlines = deadlines
+        silences = np.diff(deadlines, prepend=0) != 0
+        sizes = silences + 1
+        # Для каждого действия: номер группы (-1 - пауза), таймстемп и срок паузы
+        self.groups = np.repeat(np.arange(len(timestamps)), sizes)
+        silence_indices = (np.cumsum(sizes) - sizes)[silences]
+        silence_groups = self.groups[silence_indices]
+        self.action_timestamps = timestamps[self.groups]
+        self.action_timestamps[silence_indices] = np.where(silence_groups > 0, timestamps[silence_groups - 1], 0)
+        self.action_deadlines = np.full(len(self.groups), NO_DEADLINE, dtype=np.int64)
+        self.action_deadlines[silence_indices] = deadlines[silence_groups]
+        self.groups[silence_indices] = -1
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        group = int(self.groups[index])
+        if group < 0:
+            return self.create_silence(timestamp=self.get_timestamp(index), deadline=self.get_deadline(index))
+        return self.create_action(group=group)
+
+    def get_timestamp(self, index: int) -> int:
+        return int(self.action_timestamps[index])
+
+    def get_deadline(self, index: int) -> int | None:
+        deadline = int(self.action_deadlines[index])
+        return None if deadline == NO_DEADLINE else deadline
+
+    def find(self, timestamp: int) -> int:
+        """
+        Номер первого действия с таймстемпом не меньше timestamp
+        """
+        return int(np.searchsorted(self.action_timestamps, timestamp, side='left'))
+
+    def execute(self, index: int):
+        group = int(self.groups[index])
+        if group >= 0:
+            self.execute_group(group=group)
+
+    def execute_group(self, group: int):
+        self.create_action(group=group).execute()
+
+    @abc.abstractmethod
+    def create_action(self, group: int) -> Action:
+        ...
+
+    @abc.abstractmethod
+    def create_silence(self, timestamp: int, deadline: int) -> Action:
+        ...
@@ -1,5 +1,11 @@
+import ctypes
+import sys
+
+from src.adapters.recording import SessionRecorder
 from src.domain.engine import Engine
 from src.adapters.mock.engine import SocketSessionFactory
+from src.adapters.status import HeartbeatObserver, SharedMemoryStatusObserver
+from src.entrypoints.socket.status import MOCK_STATUS_SHM_NAME
 
 
 MOCK_SOCKET_HOST = 'localhost'
@@ -7,16 +13,28 @@ MOCK_SOCKET_PORT = 6666
 
 
 def main():
-    engine = Engine(
-        session_factories=[
-            SocketSessionFactory(
-                host=MOCK_SOCKET_HOST,
-                port=MOCK_SOCKET_PORT
-            )
-        ]
+    engine = create_engine(
+        status_name=MOCK_STATUS_SHM_NAME,
+        recording_path=sys.argv[1] if len(sys.argv) > 1 else None
     )
     engine.run()
 
 
+def create_engine(
+        status_name: str,
+        heartbeat: ctypes.c_double | None = None,
+        recording_path: str | None = None
+) -> Engine:
+    session_factory = SocketSessionFactory(
+        host=MOCK_SOCKET_HOST,
+        port=MOCK_SOCKET_PORT,
+        status_observer=SharedMemoryStatusObserver(name=status_name),
+        recorder=SessionRecorder(path=recording_path) if recording_path is not None else None
+    )
+    if heartbeat is not None:
+        session_factory.player_registry.add_observer(observer=HeartbeatObserver(heartbeat=heartbeat))
+    return Engine(session_factories=[session_factory])
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,24 @@
+import sys
+import time
+
+from src.adapters.status import SharedMemoryStatusReader
+
+MOCK_STATUS_SHM_NAME = 'rock_and_roll_status'
+STATUS_POLL_INTERVAL = 0.1
+
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else MOCK_STATUS_SHM_NAME
+    reader = SharedMemoryStatusReader(name=name)
+    prev_statuses = None
+    while True:
+        statuses = reader.read()
+        if statuses != prev_statuses:
+            for status in statuses:
+                print(status)
+            prev_statuses = statuses
+        time.sleep(STATUS_POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
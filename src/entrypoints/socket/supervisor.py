@@ -0,0 +1,132 @@
+import ctypes
+import dataclasses
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from src.entrypoints.socket.server import create_engine
+from src.entrypoints.socket.status import MOCK_STATUS_SHM_NAME
+
+WORKERS_COUNT = os.cpu_count() or 1
+HEALTH_CHECK_INTERVAL = 1
+DRAIN_TIMEOUT = 30
+# Обработчик, который не делал шагов дольше этого времени, считается зависшим
+HEARTBEAT_TIMEOUT = 10
+# Задержка перезапуска удваивается после каждого падения подряд
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+# Обработчик, проработавший дольше, считается стабильным, задержка сбрасывается
+STABLE_UPTIME = 60
+
+
+@dataclasses.dataclass
+class Worker:
+    index: int
+    heartbeat: ctypes.c_double
+    process: multiprocessing.Process | None = None
+    started_at: float = 0.0
+    restart_delay: float = RESTART_DELAY
+    restart_at: float = 0.0
+
+
+class Supervisor:
+    """
+    Запускает несколько процессов с собственным Engine на общем порту
+    (SO_REUSEPORT), перезапускает упавшие и зависшие процессы с нарастающей
+    задержкой и при остановке дает им доработать текущие сессии в течение
+    drain_timeout секунд
+    """
+
+    def __init__(self, workers_count: int, drain_timeout: float):
+        self.workers_count = workers_count
+        self.drain_timeout = drain_timeout
+        self.workers: list[Worker] = []
+        self.is_running = False
+
+    def run(self):
+        self.is_running = True
+        signal.signal(signal.SIGTERM, self.handle_stop_signal)
+        signal.signal(signal.SIGINT, self.handle_stop_signal)
+        self.workers = [
+            Worker(index=index, heartbeat=multiprocessing.RawValue('d', 0.0))
+            for index in range(self.workers_count)
+        ]
+        for worker in self.workers:
+            self.start_worker(worker=worker)
+        while self.is_running:
+            self.check_workers()
+            time.sleep(HEALTH_CHECK_INTERVAL)
+        self.drain()
+
+    def handle_stop_signal(self, signum, frame):
+        self.is_running = False
+
+    def start_worker(self, worker: Worker):
+        worker.started_at = time.monotonic()
+        worker.heartbeat.value = worker.started_at
+        worker.process = multiprocessing.Process(target=run_worker, args=(worker.index, worker.heartbeat), daemon=True)
+        worker.process.start()
+        print(f'Запущен обработчик {worker.process.pid}')
+
+    def check_workers(self):
+        now = time.monotonic()
+        for worker in self.workers:
+            process = worker.process
+            if process is None:
+                if now >= worker.restart_at:
+                    self.start_worker(worker=worker)
+                continue
+            silence = now - worker.heartbeat.value
+            if process.is_alive() and silence > HEARTBEAT_TIMEOUT:
+                print(f'Обработчик {process.pid} не отвечает {silence:.0f} с, принудительная остановка')
+                process.kill()
+                process.join()
+            if not process.is_alive():
+                self.schedule_restart(worker=worker, now=now)
+
+    def schedule_restart(self, worker: Worker, now: float):
+        if now - worker.started_at >= STABLE_UPTIME:
+            worker.restart_delay = RESTART_DELAY
+        print(
+            f'Обработчик {worker.process.pid} завершился с кодом {worker.process.exitcode}, '
+            f'перезапуск через {worker.restart_delay} с'
+        )
+        worker.process.close()
+        worker.process = None
+        worker.restart_at = now + worker.restart_delay
+        worker.restart_delay = min(worker.restart_delay * 2, MAX_RESTART_DELAY)
+
+    def drain(self):
+        processes = [worker.process for worker in self.workers if worker.process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + self.drain_timeout
+        for process in processes:
+            process.join(timeout=max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                print(f'Обработчик {process.pid} не завершился за {self.drain_timeout} с, принудительная остановка')
+                process.kill()
+                process.join()
+
+
+def run_worker(index: int, heartbeat: ctypes.c_double):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    engine = create_engine(status_name=f'{MOCK_STATUS_SHM_NAME}_{index}', heartbeat=heartbeat)
+    signal.signal(signal.SIGTERM, lambda signum, frame: engine.stop())
+    engine.run()
+
+
+def main():
+    workers_count = int(sys.argv[1]) if len(sys.argv) > 1 else WORKERS_COUNT
+    supervisor = Supervisor(
+        workers_count=workers_count,
+        drain_timeout=DRAIN_TIMEOUT
+    )
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main()
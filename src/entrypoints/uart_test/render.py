@@ -0,0 +1,48 @@
+import json
+import sys
+
+from src.adapters.work.player import CompiledTrack
+from src.adapters.work.render import LATENESS_TOLERANCE_MS, render
+from src.adapters.work.scheduler import MAX_LEAD_MS, UART_BAUDRATE, BandwidthScheduler
+
+
+def main():
+    """
+    Мгновенно проигрывает трек из файла и печатает вывод в UART, монитор
+    и статистику. Код возврата 1, если часть кадров не укладывается в скорость UART
+    """
+    with open(sys.argv[1], 'rb') as file:
+        payload = file.read().strip()
+    baudrate = int(sys.argv[2]) if len(sys.argv) > 2 else UART_BAUDRATE
+    max_lead_ms = int(sys.argv[3]) if len(sys.argv) > 3 else MAX_LEAD_MS
+    result = render(
+        payload=payload,
+        baudrate=baudrate,
+        scheduler=BandwidthScheduler(baudrate=baudrate, max_lead_ms=max_lead_ms)
+    )
+    for output in result.uart_output:
+        print(f'{output.timestamp_ms:.3f}\tUART\t{output.data!r}')
+    for output in result.monitor_output:
+        print(f'{output.timestamp_ms:.3f}\tMONITOR\t{output.data.decode()}')
+    frames_count = sum(output.data.count(CompiledTrack.FINISH_MARKER) for output in result.uart_output)
+    duration_s = result.duration_ms / 1000
+    late_scheduled_bursts = [
+        burst for burst in result.scheduled_bursts
+        if burst.actual_lateness_ms is not None and burst.actual_lateness_ms > LATENESS_TOLERANCE_MS
+    ]
+    statistics = {
+        'duration_ms': result.duration_ms,
+        'writes': len(result.uart_output),
+        'frames': frames_count,
+        'average_density': frames_count / duration_s if duration_s else frames_count,
+        'peak_density': result.peak_density,
+        'late_writes': [burst.__dict__ for burst in result.bursts],
+        'late_scheduled_bursts': [burst.__dict__ for burst in late_scheduled_bursts],
+    }
+    print(json.dumps(statistics, indent=2))
+    if result.bursts or late_scheduled_bursts:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import collections
+import math
+import os
+import select
+import socket
+import sys
+import time
+
+from src.adapters.recording import Record, RecordKind, SessionRecorder, get_baudrate, read_runs
+from src.adapters.work.engine import SocketSessionFactory
+from src.adapters.work.scheduler import UART_BAUDRATE, BandwidthScheduler
+from src.domain.engine import Engine
+from src.generic.clock import VirtualClock
+
+REPLAY_SUFFIX = '.replay'
+INPUT_KINDS = (RecordKind.CONNECT, RecordKind.COMMAND, RecordKind.DISCONNECT)
+
+
+class NullSerial:
+    out_waiting = 0
+
+    def write(self, data) -> int:
+        return len(data)
+
+
+class ReplayClock(VirtualClock):
+    """
+    Виртуальные часы повтора. Когда Engine ждет, а готовых сокетов нет,
+    часы сдвигаются до ближайшей записанной команды и передают ее Engine,
+    поэтому команды приходят внутри цикла Engine ровно в записанное время.
+    speed > 0 - время идет не быстрее, чем в speed раз быстрее реального
+    """
+
+    def __init__(self, replay: Replay, speed: float = 0):
+        super().__init__()
+        self.replay = replay
+        self.speed = speed
+
+    def sleep(self, seconds: float):
+        self.advance(now_ns=self.now_ns + math.ceil(seconds * 1e9))
+
+    def wait(self, sockets: list, timeout: float) -> list:
+        self.replay.drain()
+        to_read, _, _ = select.select(sockets, [], [], 0)
+        if to_read:
+            return to_read
+        deadline_ns = self.now_ns + math.ceil(timeout * 1e9)
+        next_ns = self.replay.get_next_timestamp_ns()
+        if next_ns is None:
+            self.advance(now_ns=min(deadline_ns, max(self.replay.end_ns, self.now_ns)))
+            if self.now_ns >= self.replay.end_ns:
+                self.replay.finish()
+            return []
+        if next_ns > deadline_ns:
+            self.advance(now_ns=deadline_ns)
+            return []
+        self.advance(now_ns=max(next_ns, self.now_ns))
+        self.replay.feed()
+        to_read, _, _ = select.select(sockets, [], [], 0)
+        return to_read
+
+    def advance(self, now_ns: int):
+        if self.speed > 0:
+            time.sleep((now_ns - self.now_ns) / 1e9 / self.speed)
+        self.now_ns = now_ns
+
+
+class Replay:
+    """
+    Воспроизводит записанные команды клиента на Engine с поддельными UART
+    и монитором через локальные сокеты. Engine работает на виртуальных часах
+    в текущем потоке, поэтому повтор одной записи всегда дает один и тот же
+    вывод. Весь вывод Engine записывается в новый файл. Вывод планируется
+    на скорости UART, записанной в начале прогона
+    """
+
+    def __init__(self, records: list[Record], output_path: str, speed: float = 0):
+        self.inputs = collections.deque(record for record in records if record.kind in INPUT_KINDS)
+        self.end_ns = records[-1].timestamp_ns if records else 0
+        self.clock = ReplayClock(replay=self, speed=speed)
+        baudrate = get_baudrate(records=records) or UART_BAUDRATE
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        self.recorder = SessionRecorder(path=output_path, baudrate=baudrate, clock=self.clock)
+        # Подключение к локальному сокету сразу видно слушающему сокету,
+        # а отправленная команда - сессии, без задержек сети
+        self.server_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server_socket.bind('')
+        self.server_socket.listen()
+        self.server_socket.setblocking(False)
+        monitor_socket, monitor_peer = socket.socketpair()
+        monitor_peer.setblocking(False)
+        self.peers = [monitor_peer]
+        self.client_peers = []
+        self.client_peer = None
+        self.is_finished = False
+        self.engine = Engine(
+            clock=self.clock,
+            session_factories=[
+                SocketSessionFactory(
+                    server_socket=self.server_socket,
+                    uart_client=NullSerial(),
+                    monitor_socket=monitor_socket,
+                    recorder=self.recorder,
+                    clock=self.clock,
+                    scheduler=BandwidthScheduler(baudrate=baudrate)
+                )
+            ]
+        )
+
+    def run(self):
+        self.engine.run()
+        for peer in self.peers:
+            peer.close()
+        self.recorder.close()
+
+    def get_next_timestamp_ns(self) -> int | None:
+        return self.inputs[0].timestamp_ns if self.inputs else None
+
+    def feed(self):
+        """
+        Передает Engine следующую записанную команду
+        """
+        record = self.inputs.popleft()
+        if record.kind == RecordKind.CONNECT:
+            self.client_peer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.client_peer.connect(self.server_socket.getsockname())
+            self.client_peer.setblocking(False)
+            self.peers.append(self.client_peer)
+            self.client_peers.append(self.client_peer)
+        elif record.kind == RecordKind.COMMAND and self.client_peer is not None:
+            self.client_peer.sendall(record.data)
+        elif record.kind == RecordKind.DISCONNECT and self.client_peer is not None:
+            self.shutdown_client(client_peer=self.client_peer)
+            self.client_peer = None
+
+    def finish(self):
+        if not self.is_finished:
+            self.is_finished = True
+            for client_peer in list(self.client_peers):
+                self.shutdown_client(client_peer=client_peer)
+            self.engine.stop()
+
+    def shutdown_client(self, client_peer: socket.socket):
+        client_peer.shutdown(socket.SHUT_WR)
+        self.client_peers.remove(client_peer)
+
+    def drain(self):
+        """
+        Вычитывает ответы и вывод монитора, чтобы Engine не заблокировался
+        на переполненном сокете
+        """
+        for peer in list(self.peers):
+            while True:
+                try:
+                    data = peer.recv(65536)
+                except BlockingIOError:
+                    break
+                if data == b'':
+                    peer.close()
+                    self.peers.remove(peer)
+                    break
+
+
+def compare(original: list[Record], replayed: list[Record]):
+    for kind in RecordKind:
+        if kind == RecordKind.START:
+            continue
+        original_records = [record for record in original if record.kind == kind]
+        replayed_records = [record for record in replayed if record.kind == kind]
+        line = f'{kind.name}: {len(original_records)} -> {len(replayed_records)}'
+        if original_records and replayed_records:
+            original_origin = get_origin_ns(records=original)
+            replayed_origin = get_origin_ns(records=replayed)
+            mismatches = 0
+            max_lateness_ms = 0.0
+            for original_record, replayed_record in zip(original_records, replayed_records):
+                if original_record.data != replayed_record.data:
+                    mismatches += 1
+                lateness_ms = (
+                    (replayed_record.timestamp_ns - replayed_origin)
+                    - (original_record.timestamp_ns - original_origin)
+                ) / 1e6
+                max_lateness_ms = max(max_lateness_ms, abs(lateness_ms))
+            line += f', data mismatches: {mismatches}, max timing deviation: {max_lateness_ms:.1f} ms'
+        print(line)
+
+
+def get_origin_ns(records: list[Record]) -> int:
+    for record in records:
+        if record.kind == RecordKind.CONNECT:
+            return record.timestamp_ns
+    return records[0].timestamp_ns
+
+
+def main():
+    """
+    Аргументы: файл записи, ускорение (по умолчанию 0 - без ожидания),
+    файл для вывода, номер прогона (по умолчанию последний)
+    """
+    path = sys.argv[1]
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    output_path = sys.argv[3] if len(sys.argv) > 3 else path + REPLAY_SUFFIX
+    run_index = int(sys.argv[4]) if len(sys.argv) > 4 else -1
+    records = read_runs(path=path)[run_index]
+    Replay(records=records, output_path=output_path, speed=speed).run()
+    compare(original=records, replayed=read_runs(path=output_path)[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,29 @@
 import socket
+import sys
 
-import serial
-
+from src.adapters.recording import SessionRecorder
 from src.domain.engine import Engine
+from src.adapters.status import SharedMemoryStatusObserver
 from src.adapters.work.engine import SocketSessionFactory
+from src.adapters.work.scheduler import BandwidthScheduler
+from src.adapters.work.uart import UARTSerial
 from src.entrypoints.uart_test.monitor import MOCK_MONITOR_SOCKET_HOST, MOCK_MONITOR_SOCKET_PORT
 
+UART_STATUS_SHM_NAME = 'rock_and_roll_uart_status'
+
 
 def main():
+    uart_client = create_uart()
+    recorder = SessionRecorder(path=sys.argv[1], baudrate=uart_client.baudrate) if len(sys.argv) > 1 else None
     engine = Engine(
         session_factories=[
             SocketSessionFactory(
                 server_socket=create_server_socket(),
-                uart_client=create_uart(),
-                monitor_socket=create_monitor_socket()
+                uart_client=uart_client,
+                monitor_socket=create_monitor_socket(),
+                status_observer=SharedMemoryStatusObserver(name=UART_STATUS_SHM_NAME),
+                recorder=recorder,
+                scheduler=BandwidthScheduler(baudrate=uart_client.baudrate)
             )
         ]
     )
@@ -28,7 +38,7 @@ def create_server_socket():
 
 
 def create_uart():
-    return serial.Serial(
+    return UARTSerial(
         '/dev/ttyAMA0',
         baudrate=115200,
     )
@@ -0,0 +1,81 @@
+from __future__ import annotations
+
+import abc
+import math
+import select
+import time
+
+
+class Clock(abc.ABC):
+    @abc.abstractmethod
+    def monotonic(self) -> float:
+        ...
+
+    def monotonic_ns(self) -> int:
+        return round(self.monotonic() * 1e9)
+
+    def wait(self, sockets: list, timeout: float) -> list:
+        """
+        Ждет, пока один из сокетов не станет доступен для чтения, но не дольше
+        timeout секунд по этим часам. Возвращает готовые сокеты
+        """
+        to_read, _, _ = select.select(sockets, [], [], timeout)
+        return to_read
+
+
+class SystemClock(Clock):
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def monotonic_ns(self) -> int:
+        return time.monotonic_ns()
+
+
+class ScaledClock(Clock):
+    """
+    Часы, которые идут в speed раз быстрее системных
+    """
+
+    def __init__(self, speed: float):
+        self.speed = speed
+        self.start = time.monotonic()
+
+    def monotonic(self) -> float:
+        return self.start + (time.monotonic() - self.start) * self.speed
+
+    def wait(self, sockets: list, timeout: float) -> list:
+        return super().wait(sockets=sockets, timeout=timeout / self.speed)
+
+
+class VirtualClock(Clock):
+    """
+    Часы, которые не ждут: sleep только сдвигает текущее время.
+    Позволяет проиграть трек мгновенно
+    """
+
+    def __init__(self, now_ns: int = 0):
+        self.now_ns = now_ns
+
+    def monotonic(self) -> float:
+        return self.now_ns / 1e9
+
+    def monotonic_ns(self) -> int:
+        return self.now_ns
+
+    def sleep(self, seconds: float):
+        """
+        Время сдвигается хотя бы на наносекунду, иначе ожидание короче
+        наносекунды никогда бы не закончилось
+        """
+        if seconds > 0:
+            self.now_ns += max(math.ceil(seconds * 1e9), 1)
+
+    def wait(self, sockets: list, timeout: float) -> list:
+        """
+        Готовность сокетов проверяется без ожидания, если готовых нет,
+        время просто сдвигается на timeout
+        """
+        to_read = super().wait(sockets=sockets, timeout=0)
+        if not to_read:
+            self.sleep(timeout)
+        return to_read